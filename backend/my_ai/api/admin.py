@@ -1,9 +1,13 @@
 from django.contrib import admin
 
-from .models import Project, UploadedFile, ChatSession
+from .models import Project, UploadedFile, ChatSession, ArchivedSession, Citation, UsageRecord, DailyUsage
 
 admin.site.register(Project)
 admin.site.register(UploadedFile)
 admin.site.register(ChatSession)
+admin.site.register(Citation)
+admin.site.register(ArchivedSession)
+admin.site.register(UsageRecord)
+admin.site.register(DailyUsage)
 
 # Register your models here.
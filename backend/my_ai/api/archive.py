@@ -0,0 +1,157 @@
+import datetime
+import json
+import logging
+import zlib
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .fast_serializers import FastListSerializer
+from .models import SESSION_PREVIEW_CHARS, ArchivedSession, ChatMessage, ChatSession, Citation, UsageRecord
+from .serializers import ChatMessageSerializer
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional; blocks are written with zlib without it
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Defaults for chat history archival; override via settings.CHAT_ARCHIVE
+CHAT_ARCHIVE_DEFAULTS = {
+    'IDLE_DAYS': 90,  # Sessions without activity for this long are archived
+    'CODEC': 'zstd',  # 'zstd' (needs the zstandard package, else zlib is used) or 'zlib'
+    'ZSTD_LEVEL': 10,
+    'ZLIB_LEVEL': 6,
+    'BATCH_SIZE': 1000,  # Rows per bulk_create when rehydrating
+}
+
+
+def get_archive_settings():
+    return {**CHAT_ARCHIVE_DEFAULTS, **getattr(settings, 'CHAT_ARCHIVE', {})}
+
+
+def _compress(raw, config):
+    if config['CODEC'] == 'zstd' and zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=config['ZSTD_LEVEL']).compress(raw)
+    return 'zlib', zlib.compress(raw, config['ZLIB_LEVEL'])
+
+
+def _decompress(codec, data):
+    data = bytes(data)  # BinaryField may come back as a memoryview
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("This archive block is zstd-compressed; install the zstandard package to read it.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown archive codec: {codec}")
+
+
+def cold_sessions(idle_days=None):
+    """Sessions with hot messages and no activity for `idle_days`."""
+    idle_days = get_archive_settings()['IDLE_DAYS'] if idle_days is None else idle_days
+    cutoff = timezone.now() - datetime.timedelta(days=idle_days)
+    return (
+        ChatSession.objects.with_activity()
+        .filter(archive__isnull=True, last_activity_at__lt=cutoff, message_count__gt=0)
+        .order_by('last_activity_at')
+    )
+
+
+def archive_session(session, idle_days=None):
+    """
+    Pack a session's messages and citations into one compressed block and delete
+    the hot rows. Returns the ArchivedSession, or None if the session became
+    active again (or has nothing to archive) by the time its lock was taken.
+    """
+    config = get_archive_settings()
+    idle_days = config['IDLE_DAYS'] if idle_days is None else idle_days
+    cutoff = timezone.now() - datetime.timedelta(days=idle_days)
+    with transaction.atomic():
+        # Serializes with rehydrate_session(), which continuing a conversation goes through
+        ChatSession.objects.select_for_update().filter(pk=session.pk).first()
+        if ArchivedSession.objects.filter(session=session).exists():
+            return None
+        messages = ChatMessage.objects.filter(session=session).order_by('timestamp', 'id')
+        latest = messages.last()
+        if latest is None or latest.timestamp >= cutoff:
+            return None
+        # Summarize like ChatSessionQuerySet.with_activity(): tool-call records are not conversation
+        conversation = messages.exclude(role='tool')
+        latest_reply = conversation.last()
+
+        raw = FastListSerializer(ChatMessageSerializer).render(messages)
+        codec, data = _compress(raw, config)
+        archive = ArchivedSession.objects.create(
+            session=session,
+            codec=codec,
+            data=data,
+            message_count=conversation.count(),
+            last_message_at=latest.timestamp,
+            last_message_preview=latest_reply.content[:SESSION_PREVIEW_CHARS] if latest_reply else None,
+            raw_bytes=len(raw),
+        )
+        # Deleting the messages nulls UsageRecord.message (SET_NULL); keep the ids to link them back on rehydrate
+        UsageRecord.objects.filter(message__session=session).update(archived_message_id=F('message_id'))
+        # Citations go with their messages (on_delete=CASCADE)
+        messages.delete()
+    logger.info(f"Archived session {session.pk}: {archive.message_count} messages, {len(raw)} -> {len(data)} bytes ({codec})")
+    return archive
+
+
+def read_archived_messages(archive):
+    """The archived message list as JSON bytes, exactly as the messages API rendered it."""
+    return _decompress(archive.codec, archive.data)
+
+
+def rehydrate_session(session):
+    """
+    Move an archived session's messages back into the hot tables, keeping their
+    ids and timestamps, and link their usage records to them again. Returns the number of messages restored (0 if the session
+    was not archived). Call it inside the transaction that adds new messages.
+    """
+    # Most sessions are hot: answer those with a single indexed lookup and no lock
+    if not ArchivedSession.objects.filter(session=session).exists():
+        return 0
+    with transaction.atomic():
+        ChatSession.objects.select_for_update().filter(pk=session.pk).first()
+        archive = ArchivedSession.objects.filter(session=session).first()
+        if archive is None:
+            return 0
+
+        items = json.loads(read_archived_messages(archive))
+        batch_size = get_archive_settings()['BATCH_SIZE']
+        messages = [
+            ChatMessage(
+                id=item['id'],
+                session=session,
+                role=item['role'],
+                content=item['content'],
+                tool_call_id=item.get('tool_call_id'),
+                tool_name=item.get('tool_name'),
+            )
+            for item in items
+        ]
+        ChatMessage.objects.bulk_create(messages, batch_size=batch_size)
+        # auto_now_add overwrote the timestamps on insert; put the original ones back
+        for message, item in zip(messages, items):
+            message.timestamp = parse_datetime(item['timestamp'])
+        ChatMessage.objects.bulk_update(messages, ['timestamp'], batch_size=batch_size)
+        Citation.objects.bulk_create(
+            (
+                Citation(message_id=item['id'], **citation)
+                for item in items
+                for citation in item.get('citations', [])
+            ),
+            batch_size=batch_size,
+        )
+        UsageRecord.objects.filter(session=session, archived_message_id__isnull=False).update(
+            message_id=F('archived_message_id'), archived_message_id=None
+        )
+        archive.delete()
+    logger.info(f"Rehydrated session {session.pk}: {len(items)} messages")
+    return len(items)
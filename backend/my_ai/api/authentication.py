@@ -0,0 +1,95 @@
+import copy
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .caching import TTLCache
+
+# Defaults for the token cache; override via settings.TOKEN_AUTH_CACHE
+TOKEN_AUTH_CACHE_DEFAULTS = {
+    'MAX_ENTRIES': 1024,  # Upper bound on tokens kept in the in-process cache
+    'TTL': 300,  # Seconds before a cached token is re-validated against the DB
+    # Django cache alias for a cross-process cache (e.g. 'default' backed by Redis). Without one the
+    # cache lives in each worker process: logout, deactivation and permission changes then only evict
+    # the token in the process that handled them, and other workers keep honouring it for up to TTL.
+    # Set a shared backend whenever more than one worker process serves the API.
+    'BACKEND': None,
+}
+
+CACHE_KEY_PREFIX = 'api:auth_token:'
+
+
+def get_token_cache_settings():
+    return {**TOKEN_AUTH_CACHE_DEFAULTS, **getattr(settings, 'TOKEN_AUTH_CACHE', {})}
+
+
+_cache_settings = get_token_cache_settings()
+_local_cache = TTLCache(max_entries=_cache_settings['MAX_ENTRIES'], ttl=_cache_settings['TTL'])
+
+
+def _shared_cache():
+    alias = get_token_cache_settings()['BACKEND']
+    return caches[alias] if alias else None
+
+
+def get_cached_token(key):
+    shared = _shared_cache()
+    if shared is not None:
+        return shared.get(CACHE_KEY_PREFIX + key)
+    return _local_cache.get(key)
+
+
+def set_cached_token(key, user, token):
+    shared = _shared_cache()
+    if shared is not None:
+        shared.set(CACHE_KEY_PREFIX + key, (user, token), timeout=get_token_cache_settings()['TTL'])
+    else:
+        _local_cache.set(key, (user, token))
+
+
+def invalidate_token(key):
+    """Drop a single token from the cache, e.g. on logout."""
+    shared = _shared_cache()
+    if shared is not None:
+        shared.delete(CACHE_KEY_PREFIX + key)
+    _local_cache.delete(key)
+
+
+def invalidate_user_tokens(user):
+    """Drop every cached token belonging to `user`, e.g. on deactivation."""
+    for key in Token.objects.filter(user_id=user.pk).values_list('key', flat=True):
+        invalidate_token(key)
+    _local_cache.delete_where(lambda entry: entry[0].pk == user.pk)
+
+
+def _for_request(user, token):
+    # The in-process cache hands the same instances to every request for up to TTL; give each request
+    # its own copies so anything set on request.user (permission caches, related objects) stays with it
+    user = copy.copy(user)
+    token = copy.copy(token)
+    token.user = user
+    return user, token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in replacement for DRF's TokenAuthentication that keeps recently seen
+    tokens in a bounded TTL cache, so steady-state requests skip the
+    token/user join query.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = get_cached_token(key)
+        if cached is not None:
+            user, token = cached
+            if not user.is_active:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+            return _for_request(user, token)
+
+        user, token = super().authenticate_credentials(key)
+        set_cached_token(key, user, token)
+        return _for_request(user, token)
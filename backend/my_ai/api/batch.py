@@ -0,0 +1,264 @@
+import datetime
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import BatchJob, BatchQuestion
+from .routing import record_run_outcome
+from .scheduler import BATCH, AdmissionRejected, estimate_run_tokens, run_scheduler
+from .tools import ToolContext, resolve_required_actions
+from .usage import BudgetExceeded, record_run_usage, resolve_run_model
+
+logger = logging.getLogger(__name__)
+
+# Defaults for batch jobs; override via settings.BATCH_JOBS
+BATCH_JOBS_DEFAULTS = {
+    'MAX_CONCURRENCY': 16,  # Upper bound on worker threads per job
+    'MAX_QUESTIONS': 1000,  # Upper bound on questions per job
+    'STALE_AFTER': 120,  # Seconds without a heartbeat before a running job is considered crashed
+    'HEARTBEAT_INTERVAL': 15,  # Seconds between heartbeats while a runner is alive; keep well below STALE_AFTER
+    'ADMISSION_TIMEOUT': 600,  # Seconds a question may wait for the scheduler before it is marked failed
+}
+
+
+def get_batch_settings():
+    return {**BATCH_JOBS_DEFAULTS, **getattr(settings, 'BATCH_JOBS', {})}
+
+
+class BatchJobBusy(Exception):
+    pass
+
+
+def question_result(question):
+    return {
+        "type": "result",
+        "index": question.index,
+        "question": question.question,
+        "status": question.status,
+        "answer": question.answer,
+        "citations": question.citations,
+        "error": question.error,
+        "model": question.model,
+        "duration_ms": question.duration_ms,
+    }
+
+
+def effective_concurrency(job):
+    """Questions a job can have in flight: its requested concurrency within the batch and scheduler caps."""
+    limits = [job.concurrency, get_batch_settings()['MAX_CONCURRENCY']]
+    if run_scheduler.config['ENABLED']:
+        limits += [run_scheduler.config['BATCH_MAX_CONCURRENT'], run_scheduler.config['BATCH_MAX_ACTIVE_PER_TENANT']]
+    return max(1, min(limits))
+
+
+def job_progress(job):
+    return {**job.get_progress(), "concurrency": effective_concurrency(job)}
+
+
+def job_summary(job):
+    return {"type": "summary", "job_id": job.id, "status": job.status, **job_progress(job)}
+
+
+def stored_results(job):
+    """Results of the questions answered so far plus a summary, read from the database without running anything."""
+    for question in job.questions.filter(status__in=['done', 'failed']):
+        yield question_result(question)
+    yield job_summary(job)
+
+
+class BatchRunner:
+    """
+    Answers a BatchJob's pending questions on a bounded thread pool and yields
+    each result as it finishes.
+
+    Progress is persisted per question, so a job interrupted by a crash or a
+    dropped connection picks up where it left off the next time it is run:
+    finished questions are replayed from the database and only pending ones
+    are sent to OpenAI again.
+    """
+
+    def __init__(self, job, client, get_assistant, build_reply):
+        self.job = job
+        self.project = job.project
+        self.client = client
+        self.get_assistant = get_assistant
+        self.build_reply = build_reply
+        # Citations across a batch point at the same handful of files; look each one up once
+        self.retrieve_file = functools.lru_cache(maxsize=256)(client.files.retrieve)
+        self._budget_error = None
+
+    def _claim_job(self):
+        stale_before = timezone.now() - datetime.timedelta(seconds=get_batch_settings()['STALE_AFTER'])
+        with transaction.atomic():
+            job = BatchJob.objects.select_for_update().get(pk=self.job.pk)
+            if job.status == 'running' and job.heartbeat_at and job.heartbeat_at > stale_before:
+                raise BatchJobBusy(f"Batch job {job.id} is already running.")
+            now = timezone.now()
+            job.status = 'running'
+            job.started_at = job.started_at or now
+            job.heartbeat_at = now
+            job.save(update_fields=['status', 'started_at', 'heartbeat_at'])
+            # Questions left 'running' by a crashed runner go back into the queue
+            reset = job.questions.filter(status='running').update(status='pending')
+            if reset:
+                logger.warning(f"Batch job {job.id}: re-queued {reset} questions interrupted by a previous run.")
+        self.job = job
+
+    def _question_model(self):
+        """
+        Model for the next question. The budget is checked again for every question, since
+        the batch itself spends it; once it trips, the remaining questions fail without asking.
+        """
+        if self._budget_error is not None:
+            raise self._budget_error
+        try:
+            return resolve_run_model(self.project)
+        except BudgetExceeded as e:
+            self._budget_error = e
+            raise
+
+    def _acquire(self, question, run_model):
+        """Wait for a scheduler ticket, retrying rejections until ADMISSION_TIMEOUT runs out."""
+        timeout = get_batch_settings()['ADMISSION_TIMEOUT']
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return run_scheduler.acquire(
+                    self.job.user_id, self.project.id, run_model, estimate_run_tokens(question.question), lane=BATCH
+                )
+            except AdmissionRejected as e:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise AdmissionRejected(
+                        f"Not admitted by the run scheduler within {timeout}s: {e}", e.retry_after
+                    ) from e
+                # Batch work is never urgent: back off and let interactive traffic through
+                time.sleep(min(e.retry_after, remaining))
+
+    def _answer(self, question_id):
+        try:
+            if not BatchQuestion.objects.filter(pk=question_id, status='pending').update(status='running'):
+                return None
+            question = BatchQuestion.objects.get(pk=question_id)
+            ticket = None
+            thread_id = None
+            try:
+                run_model = self._question_model()
+                ticket = self._acquire(question, run_model)
+                run_params = {
+                    "assistant_id": self.assistant.id,
+                    "thread": {"messages": [{"role": "user", "content": question.question}]},
+                }
+                if run_model != self.project.model:
+                    run_params["model"] = run_model
+                run_started = time.monotonic()
+                try:
+                    run = self.client.beta.threads.create_and_run_poll(**run_params)
+                    run = resolve_required_actions(self.client, run, ToolContext(self.project, user=self.job.user))
+                except Exception:
+                    record_run_outcome(run_model, int((time.monotonic() - run_started) * 1000), ok=False)
+                    raise
+                duration_ms = int((time.monotonic() - run_started) * 1000)
+                thread_id = run.thread_id
+                record_run_outcome(run_model, duration_ms, ok=run.status == 'completed')
+                usage_record = record_run_usage(self.project, run, duration_ms, run_model, user=self.job.user)
+                if usage_record:
+                    ticket.used_tokens = usage_record.prompt_tokens + usage_record.completion_tokens
+
+                question.model = run_model
+                question.duration_ms = duration_ms
+                if run.status == 'completed':
+                    messages = self.client.beta.threads.messages.list(thread_id=thread_id, order="asc")
+                    question.answer, question.citations = self.build_reply(messages.data, retrieve_file=self.retrieve_file)
+                    question.status = 'done'
+                else:
+                    question.status = 'failed'
+                    question.error = f"Assistant run failed: {run.status}"
+                    if run.last_error:
+                        question.error += f" - {run.last_error.message} (Code: {run.last_error.code})"
+            except BudgetExceeded as e:
+                question.status = 'failed'
+                question.error = str(e)
+            except Exception as e:
+                logger.error(f"Batch job {self.job.id}: question {question.index} failed: {e}", exc_info=True)
+                question.status = 'failed'
+                question.error = str(e)
+            finally:
+                if ticket is not None:
+                    run_scheduler.release(ticket)
+
+            question.completed_at = timezone.now()
+            question.save()
+            if thread_id:
+                try:
+                    self.client.beta.threads.delete(thread_id)
+                except Exception as e:
+                    logger.warning(f"Failed to delete batch thread {thread_id}: {e}")
+            return question_result(question)
+        finally:
+            # Worker threads open their own DB connections; don't leak them
+            connection.close()
+
+    def _heartbeat(self, stop):
+        # Beat on a timer rather than per finished question: a single question may run longer
+        # than STALE_AFTER, and a second runner must not mistake that for a crash and re-run it
+        try:
+            while not stop.wait(get_batch_settings()['HEARTBEAT_INTERVAL']):
+                BatchJob.objects.filter(pk=self.job.pk).update(heartbeat_at=timezone.now())
+        finally:
+            connection.close()
+
+    def start(self):
+        """
+        Claim the job and resolve the assistant once for the whole batch.
+        Raises BudgetExceeded or BatchJobBusy before any question is sent.
+        """
+        resolve_run_model(self.project)  # Refuse up front when the budget is already spent
+        self._claim_job()
+        try:
+            self.assistant = self.get_assistant(self.project)
+        except Exception:
+            BatchJob.objects.filter(pk=self.job.pk).update(status='pending')
+            raise
+
+    def results(self):
+        """Generator of result dicts (NDJSON-ready), ending with a summary. Call start() first."""
+        for question in self.job.questions.filter(status__in=['done', 'failed']):
+            yield question_result(question)
+
+        pending_ids = list(self.job.questions.filter(status='pending').values_list('id', flat=True))
+        # More workers than the scheduler admits would only wait in its queue and time out
+        concurrency = effective_concurrency(self.job)
+        started = time.monotonic()
+        pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"batch-{self.job.id}")
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(stop_heartbeat,), name=f"batch-{self.job.id}-heartbeat", daemon=True
+        )
+        heartbeat.start()
+        try:
+            futures = [pool.submit(self._answer, question_id) for question_id in pending_ids]
+            for future in as_completed(futures):
+                result = future.result()
+                if result is not None:
+                    yield result
+        finally:
+            # On a dropped connection, questions that have not started stay pending for the next run
+            pool.shutdown(wait=True, cancel_futures=True)
+            stop_heartbeat.set()
+            heartbeat.join()
+            self.job.run_seconds += time.monotonic() - started
+            remaining = self.job.questions.filter(status__in=['pending', 'running']).exists()
+            self.job.status = 'pending' if remaining else 'completed'
+            self.job.finished_at = None if remaining else timezone.now()
+            self.job.heartbeat_at = timezone.now()
+            self.job.save(update_fields=['run_seconds', 'status', 'finished_at', 'heartbeat_at'])
+            logger.info(f"Batch job {self.job.id} stopped with status {self.job.status} after {self.job.run_seconds:.1f}s")
+
+        yield job_summary(self.job)
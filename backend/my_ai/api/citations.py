@@ -0,0 +1,133 @@
+import logging
+
+from .models import Citation
+
+logger = logging.getLogger(__name__)
+
+
+class CitationRenderer:
+    """
+    Turns assistant messages into reply text with numbered markers in a single
+    pass per text block.
+
+    Annotations are placed by their start_index/end_index offsets, so every
+    annotation replaces exactly its own span and duplicate quote strings
+    cannot be confused. Annotations whose offsets are missing or stale are
+    placed at the first free occurrence of their quote; all spans are then
+    applied left to right in one pass. Cited files are looked up once per
+    render.
+    """
+
+    def __init__(self, retrieve_file):
+        self.retrieve_file = retrieve_file
+        self._files = {}
+
+    def _filename(self, file_id):
+        if file_id not in self._files:
+            try:
+                self._files[file_id] = self.retrieve_file(file_id).filename
+            except Exception as e:
+                logger.error(f"Error retrieving cited file {file_id}: {e}")
+                self._files[file_id] = None
+        return self._files[file_id]
+
+    @staticmethod
+    def _spans(text, annotations):
+        """[(start, end, annotation)] sorted by start, skipping annotations that cannot be placed."""
+        spans = []
+        pending = []
+
+        def is_free(start, end):
+            return all(end <= taken_start or taken_end <= start for taken_start, taken_end, _ in spans)
+
+        for annotation in annotations:
+            start, end = getattr(annotation, 'start_index', None), getattr(annotation, 'end_index', None)
+            quote = annotation.text or ''
+            if (start is not None and end is not None and 0 <= start <= end <= len(text)
+                    and (not quote or text[start:end] == quote) and is_free(start, end)):
+                spans.append((start, end, annotation))
+            else:
+                pending.append(annotation)
+
+        # Offsets missing or stale: fall back to the first occurrence of the quote not already cited
+        for annotation in pending:
+            quote = annotation.text or ''
+            start = text.find(quote) if quote else -1
+            while start != -1 and not is_free(start, start + len(quote)):
+                start = text.find(quote, start + 1)
+            if start == -1:
+                logger.warning(f"Skipping annotation {annotation.text!r}: not found in message text.")
+                continue
+            spans.append((start, start + len(quote), annotation))
+
+        return sorted(spans, key=lambda span: span[0])
+
+    def _citation(self, annotation, number):
+        if getattr(annotation, 'file_citation', None) is not None:
+            kind, file_id = 'file_citation', annotation.file_citation.file_id
+        elif getattr(annotation, 'file_path', None) is not None:
+            kind, file_id = 'file_path', annotation.file_path.file_id
+        else:
+            return None
+        return {
+            "number": number,
+            "marker": f"[{number}]",
+            "type": kind,
+            "file_id": file_id,
+            "filename": self._filename(file_id),
+            "quote": annotation.text or '',
+        }
+
+    def render(self, messages):
+        """Returns (reply_text, citations) for every assistant message in `messages`."""
+        parts = []
+        citations = []
+        length = 0  # Length of the reply rendered so far, for citation offsets
+
+        for msg in messages:
+            if msg.role != "assistant":
+                continue
+            message_started = False
+            for content_block in msg.content:
+                if content_block.type != 'text':
+                    continue
+                if not message_started and parts:
+                    parts.append("\n")
+                    length += 1
+                message_started = True
+
+                text = content_block.text.value
+                cursor = 0
+                for start, end, annotation in self._spans(text, getattr(content_block.text, 'annotations', None) or []):
+                    citation = self._citation(annotation, len(citations) + 1)
+                    if citation is None:
+                        continue
+                    parts.append(text[cursor:start])
+                    length += start - cursor + 1  # The marker is preceded by a space
+                    parts.append(f" {citation['marker']}")
+                    citation["start_index"] = length
+                    citation["end_index"] = length + len(citation['marker'])
+                    length = citation["end_index"]
+                    citations.append(citation)
+                    cursor = end
+                parts.append(text[cursor:])
+                length += len(text) - cursor
+
+        return "".join(parts), citations
+
+
+def save_citations(message, citations):
+    """Persist rendered citations for an assistant ChatMessage in one query."""
+    return Citation.objects.bulk_create(
+        Citation(
+            message=message,
+            number=citation["number"],
+            type=citation["type"],
+            file_id=citation["file_id"],
+            filename=citation["filename"],
+            quote=citation["quote"],
+            start_index=citation["start_index"],
+            end_index=citation["end_index"],
+        )
+        for citation in citations
+    )
@@ -0,0 +1,188 @@
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import models
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import serializers
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
+
+# Rows rendered in one response before switching to a chunked (streamed) response
+STREAM_THRESHOLD = getattr(settings, 'FAST_LIST_STREAM_THRESHOLD', 1000)
+# Rows fetched from the DB and encoded per chunk
+CHUNK_SIZE = getattr(settings, 'FAST_LIST_CHUNK_SIZE', 500)
+
+# DRF's JSONRenderer escapes these for JavaScript compatibility; mirror it byte for byte
+_LINE_SEPARATOR = '\u2028'.encode('utf-8')
+_PARAGRAPH_SEPARATOR = '\u2029'.encode('utf-8')
+
+
+def _dumps_stdlib(data):
+    # Same options as DRF's JSONRenderer with UNICODE_JSON, COMPACT_JSON and STRICT_JSON enabled
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+
+
+def _dumps(data):
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # orjson rejects lone surrogates and other inputs the stdlib encoder accepts
+            pass
+    return _dumps_stdlib(data)
+
+
+def _escape_separators(chunk):
+    return chunk.replace(_LINE_SEPARATOR, b'\\u2028').replace(_PARAGRAPH_SEPARATOR, b'\\u2029')
+
+
+class FastListSerializer:
+    """
+    Serializes querysets straight from `values_list()` rows, producing the same
+    JSON bytes that `serializer_class(many=True)` + DRF's JSONRenderer would.
+
+    Only plain `ModelSerializer`s are supported: every field must map to a
+    concrete model column (foreign keys are rendered as their primary key).
+    The one exception is a nested `many=True` serializer over a reverse foreign
+    key (e.g. a message's citations): those rows are fetched with one query per
+    chunk of parents, like prefetch_related would.
+    """
+
+    def __init__(self, serializer_class):
+        meta = serializer_class.Meta
+        model_meta = meta.model._meta
+        self.field_names = list(meta.fields)
+        self.columns = []
+        self.datetime_indexes = []
+        self.nested = []
+        for name in self.field_names:
+            declared = serializer_class._declared_fields.get(name)
+            if declared is not None:
+                self.nested.append(self._nested_relation(serializer_class, name, declared, model_meta))
+                continue
+            model_field = model_meta.get_field(name)
+            if isinstance(model_field, models.DateTimeField):
+                self.datetime_indexes.append(len(self.columns))
+            self.columns.append(model_field.attname)
+        self.pk_index = None
+        if self.nested:
+            # Nested rows are matched to their parent by primary key; fetch it if the fields don't include it
+            if model_meta.pk.attname not in self.columns:
+                self.columns.append(model_meta.pk.attname)
+            self.pk_index = self.columns.index(model_meta.pk.attname)
+
+    @staticmethod
+    def _nested_relation(serializer_class, name, declared, model_meta):
+        child = getattr(declared, 'child', None)
+        try:
+            relation = model_meta.get_field(declared.source or name)
+        except FieldDoesNotExist:
+            relation = None
+        if not (isinstance(child, serializers.ModelSerializer) and relation is not None and relation.one_to_many):
+            raise ImproperlyConfigured(
+                f"{serializer_class.__name__}.{name} is a custom field; FastListSerializer only supports model "
+                "columns and nested many=True serializers over reverse foreign keys."
+            )
+        return name, FastListSerializer(type(child)), relation.related_model, relation.field.attname
+
+    def _fetch_nested(self, rows):
+        """{field_name: {parent_pk: [child dicts]}} for the parents in `rows`."""
+        parent_ids = [row[self.pk_index] for row in rows]
+        fetched = {}
+        for name, child, related_model, fk_attname in self.nested:
+            children = {}
+            for start in range(0, len(parent_ids), CHUNK_SIZE):
+                child_rows = list(related_model.objects.filter(
+                    **{f"{fk_attname}__in": parent_ids[start:start + CHUNK_SIZE]}
+                ).values_list(fk_attname, *child.columns))
+                items = child.to_dicts(child_row[1:] for child_row in child_rows)
+                for child_row, item in zip(child_rows, items):
+                    children.setdefault(child_row[0], []).append(item)
+            fetched[name] = children
+        return fetched
+
+    def _datetime_representation(self, value, tz):
+        # Mirrors rest_framework.fields.DateTimeField.to_representation for ISO 8601 output
+        if not value:
+            return None
+        if tz is not None:
+            value = value.astimezone(tz) if timezone.is_aware(value) else timezone.make_aware(value, tz)
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    def to_dicts(self, rows):
+        tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        datetime_indexes = self.datetime_indexes
+        if self.nested:
+            rows = list(rows)
+            nested = self._fetch_nested(rows)
+        for row in rows:
+            if datetime_indexes:
+                row = list(row)
+                for index in datetime_indexes:
+                    row[index] = self._datetime_representation(row[index], tz)
+            if not self.nested:
+                yield dict(zip(self.field_names, row))
+                continue
+            values = iter(row)
+            parent_id = row[self.pk_index]
+            yield {
+                name: nested[name].get(parent_id, []) if name in nested else next(values)
+                for name in self.field_names
+            }
+
+    def encode_rows(self, rows):
+        """Encode rows as the comma-joined JSON array body (without the brackets)."""
+        return _escape_separators(b','.join(_dumps(item) for item in self.to_dicts(rows)))
+
+    def render(self, queryset):
+        """Render the whole queryset into a single JSON bytestring."""
+        return b'[' + self.encode_rows(queryset.values_list(*self.columns)) + b']'
+
+    def response(self, queryset):
+        """
+        Return an HttpResponse for small results, or a chunked StreamingHttpResponse
+        once the queryset yields more than STREAM_THRESHOLD rows.
+        """
+        rows = queryset.values_list(*self.columns).iterator(chunk_size=CHUNK_SIZE)
+        head = []
+        for row in rows:
+            head.append(row)
+            if len(head) > STREAM_THRESHOLD:
+                break
+        else:
+            return HttpResponse(b'[' + self.encode_rows(head) + b']', content_type='application/json')
+
+        def stream():
+            yield b'[' + self.encode_rows(head)
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= CHUNK_SIZE:
+                    yield b',' + self.encode_rows(chunk)
+                    chunk = []
+            if chunk:
+                yield b',' + self.encode_rows(chunk)
+            yield b']'
+
+        return StreamingHttpResponse(stream(), content_type='application/json')
+
+
+class FastListMixin:
+    """
+    For ListAPIViews: serve JSON requests through FastListSerializer and leave
+    every other renderer (e.g. the browsable API) and paginated lists to DRF.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if self.paginator is not None or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return FastListSerializer(self.get_serializer_class()).response(queryset)
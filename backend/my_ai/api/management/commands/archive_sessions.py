@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Sum
+
+from api.archive import archive_session, cold_sessions, get_archive_settings, rehydrate_session
+from api.models import ArchivedSession, ChatMessage, ChatSession
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the messages of idle chat sessions into compressed archive blocks. "
+        "Meant to run periodically (e.g. a nightly cron job)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--idle-days', type=int, default=None,
+            help="Archive sessions without activity for this many days (default: CHAT_ARCHIVE['IDLE_DAYS']).",
+        )
+        parser.add_argument('--limit', type=int, default=None, help="Archive at most this many sessions.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report which sessions would be archived.")
+        parser.add_argument(
+            '--rehydrate', type=int, metavar='SESSION_ID', default=None,
+            help="Restore one archived session into the hot tables instead.",
+        )
+
+    def handle(self, *args, **options):
+        if options['rehydrate'] is not None:
+            return self._rehydrate(options['rehydrate'])
+
+        idle_days = options['idle_days'] if options['idle_days'] is not None else get_archive_settings()['IDLE_DAYS']
+        sessions = cold_sessions(idle_days)
+        if options['limit'] is not None:
+            sessions = sessions[:options['limit']]
+
+        archived = messages = raw_bytes = stored_bytes = 0
+        for session in sessions.iterator():
+            if options['dry_run']:
+                self.stdout.write(f"Would archive session {session.id} ({session.message_count} messages, last active {session.last_activity_at:%Y-%m-%d})")
+                continue
+            archive = archive_session(session, idle_days=idle_days)
+            if archive is None:
+                continue
+            archived += 1
+            messages += archive.message_count
+            raw_bytes += archive.raw_bytes
+            stored_bytes += len(archive.data)
+
+        if not options['dry_run']:
+            ratio = f"{raw_bytes / stored_bytes:.1f}x" if stored_bytes else "n/a"
+            self.stdout.write(self.style.SUCCESS(
+                f"Archived {archived} sessions idle for {idle_days}+ days: {messages} messages, "
+                f"{raw_bytes} -> {stored_bytes} bytes ({ratio})."
+            ))
+
+        totals = ArchivedSession.objects.aggregate(sessions=Count('id'), messages=Sum('message_count'))
+        self.stdout.write(
+            f"Hot messages: {ChatMessage.objects.exclude(role='tool').count()}; archived: {totals['messages'] or 0} "
+            f"in {totals['sessions']} sessions."
+        )
+
+    def _rehydrate(self, session_id):
+        try:
+            session = ChatSession.objects.get(pk=session_id)
+        except ChatSession.DoesNotExist:
+            raise CommandError(f"Chat session {session_id} does not exist.")
+        restored = rehydrate_session(session)
+        if not restored:
+            raise CommandError(f"Chat session {session_id} is not archived.")
+        self.stdout.write(self.style.SUCCESS(f"Rehydrated session {session_id}: {restored} messages."))
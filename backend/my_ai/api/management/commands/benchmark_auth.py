@@ -0,0 +1,54 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+
+from api.authentication import CachedTokenAuthentication, invalidate_token
+
+
+class Command(BaseCommand):
+    help = "Benchmark per-request cost of DRF TokenAuthentication against CachedTokenAuthentication."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5000, help="Authenticated requests to simulate per backend.")
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        # Run inside a transaction that is always rolled back so no benchmark user is left behind
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(username='__benchmark_auth__', password='unused-password')
+            token = Token.objects.create(user=user)
+            request = Request(RequestFactory().get('/api/projects/', HTTP_AUTHORIZATION=f"Token {token.key}"))
+
+            results = {}
+            for label, backend in (('TokenAuthentication', TokenAuthentication()),
+                                   ('CachedTokenAuthentication', CachedTokenAuthentication())):
+                invalidate_token(token.key)
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    for _ in range(iterations):
+                        backend.authenticate(request)
+                    elapsed = time.perf_counter() - start
+                results[label] = (elapsed, len(queries))
+
+            invalidate_token(token.key)
+            transaction.set_rollback(True)
+
+        for label, (elapsed, query_count) in results.items():
+            self.stdout.write(
+                f"{label:<28} {elapsed / iterations * 1e6:9.1f} us/request  "
+                f"{query_count / iterations:6.3f} queries/request"
+            )
+        base_elapsed = results['TokenAuthentication'][0]
+        cached_elapsed = results['CachedTokenAuthentication'][0]
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved {(base_elapsed - cached_elapsed) / iterations * 1e6:.1f} us and "
+            f"{(results['TokenAuthentication'][1] - results['CachedTokenAuthentication'][1]) / iterations:.3f} queries per request "
+            f"({base_elapsed / cached_elapsed:.1f}x faster)."
+        ))
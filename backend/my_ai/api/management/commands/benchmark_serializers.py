@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from api.fast_serializers import FastListSerializer
+from api.models import ChatMessage, ChatSession, Project, UploadedFile
+from api.serializers import ChatMessageSerializer, UploadedFileSerializer
+
+
+class Command(BaseCommand):
+    help = "Benchmark the fast list serialization path against the DRF serializers for messages and files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help="Rows to create for each benchmarked model.")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per serializer (best run is reported).")
+
+    def _best_of(self, repeat, func):
+        best, output = None, None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, output
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        # Run inside a transaction that is always rolled back so no benchmark data is left behind
+        with transaction.atomic():
+            project = Project.objects.create(name='__benchmark_serializers__')
+            session = ChatSession.objects.create(project=project, openai_thread_id='__benchmark_thread__')
+            ChatMessage.objects.bulk_create(
+                ChatMessage(
+                    session=session,
+                    role='user' if i % 2 == 0 else 'assistant',
+                    content=f"Message {i} with unicode \u00e9\u4e2d\u2028 and \"quotes\"\n" * 5,
+                )
+                for i in range(rows)
+            )
+            UploadedFile.objects.bulk_create(
+                UploadedFile(project=project, filename=f"document-{i}.pdf", openai_file_id=f"file-benchmark-{i}")
+                for i in range(rows)
+            )
+
+            cases = (
+                ('ChatMessageSerializer', ChatMessageSerializer,
+                 ChatMessage.objects.filter(session=session).prefetch_related('citations').order_by('timestamp')),
+                ('UploadedFileSerializer', UploadedFileSerializer,
+                 UploadedFile.objects.filter(project=project).order_by('-uploaded_at')),
+            )
+            for label, serializer_class, queryset in cases:
+                drf_time, drf_bytes = self._best_of(
+                    repeat, lambda: JSONRenderer().render(serializer_class(queryset.all(), many=True).data)
+                )
+                fast = FastListSerializer(serializer_class)
+                fast_time, fast_bytes = self._best_of(repeat, lambda: fast.render(queryset.all()))
+                if fast_bytes != drf_bytes:
+                    raise CommandError(f"{label}: fast path output differs from DRF output.")
+                self.stdout.write(
+                    f"{label:<24} {rows} rows  DRF {drf_time * 1e3:8.1f} ms  "
+                    f"fast {fast_time * 1e3:8.1f} ms  ({drf_time / fast_time:.1f}x, byte-identical)"
+                )
+
+            transaction.set_rollback(True)
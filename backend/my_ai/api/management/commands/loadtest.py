@@ -0,0 +1,504 @@
+import http.client
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+PROMPTS = [
+    "What are the main points covered in the uploaded documents?",
+    "Summarize the last answer in two sentences.",
+    "Can you explain that in simpler terms?",
+    "What does the policy say about refunds?",
+    "List three action items from our discussion.",
+    "How many days are there between 2024-01-15 and 2024-03-01?",
+    "Which section of the report talks about costs?",
+    "Thanks! One more question: what should I read first?",
+]
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    """
+    Thread-safe store of request samples: (endpoint, finished_at, duration_ms, status, error).
+    429 responses carry no error: admission rejections are reported on their own.
+    """
+
+    def __init__(self):
+        self.samples = []
+        self.active_users = 0
+        self.iterations = 0
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, finished_at, duration_ms, status, error):
+        with self._lock:
+            self.samples.append((endpoint, finished_at, duration_ms, status, error))
+
+    def user_started(self):
+        with self._lock:
+            self.active_users += 1
+
+    def user_stopped(self):
+        with self._lock:
+            self.active_users -= 1
+
+    def iteration_finished(self):
+        with self._lock:
+            self.iterations += 1
+
+
+class ApiClient:
+    """Minimal keep-alive JSON client over http.client; one per virtual user (not thread-safe)."""
+
+    def __init__(self, base_url, timeout, recorder, started):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise CommandError(f"Invalid base URL: {base_url}")
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.recorder = recorder
+        self.started = started
+        self.token = None
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def request(self, endpoint, method, path, json_body=None, body=None, content_type=None):
+        """
+        Send one request and record it under `endpoint` (the path template). Returns
+        (status, parsed JSON or None); status is None when the request itself failed.
+        """
+        headers = {'Accept': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f"Token {self.token}"
+        if json_body is not None:
+            body = json.dumps(json_body).encode('utf-8')
+            content_type = 'application/json'
+        if content_type:
+            headers['Content-Type'] = content_type
+
+        status, payload, error = None, None, None
+        request_started = time.monotonic()
+        try:
+            connection = self._connect()
+            connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = connection.getresponse()
+            raw = response.read()
+            status = response.status
+            if response.getheader('Connection', '').lower() == 'close':
+                self.close()
+            try:
+                payload = json.loads(raw) if raw else None
+            except ValueError:
+                payload = None
+            if status >= 400 and status != 429:
+                error = f"HTTP {status}"
+        except (OSError, http.client.HTTPException) as e:
+            # Drop the connection so the next request starts from a fresh one
+            self.close()
+            error = f"{type(e).__name__}: {e}"
+        finished = time.monotonic()
+        self.recorder.record(
+            f"{method} {endpoint}", finished - self.started, (finished - request_started) * 1000, status, error
+        )
+        return status, payload
+
+    def upload(self, endpoint, path, filename, content):
+        boundary = uuid.uuid4().hex
+        body = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            "Content-Type: text/plain\r\n\r\n"
+        ).encode('utf-8') + content + f"\r\n--{boundary}--\r\n".encode('utf-8')
+        return self.request(endpoint, 'POST', path, body=body, content_type=f"multipart/form-data; boundary={boundary}")
+
+
+class VirtualUser(threading.Thread):
+    """
+    One simulated user: log in (and with --project-per-user create its own project),
+    then until the deadline repeatedly open a chat session, send a few messages,
+    list the history and sometimes upload a file, pausing for a think time between actions.
+    """
+
+    def __init__(self, index, options, credentials, project_id, recorder, started, start_delay, deadline):
+        super().__init__(name=f"loadtest-user-{index}", daemon=True)
+        self.index = index
+        self.options = options
+        self.credentials = credentials
+        self.project_id = project_id
+        self.recorder = recorder
+        self.start_delay = start_delay
+        self.deadline = deadline
+        self.random = random.Random(options['seed'] + index if options['seed'] is not None else None)
+        self.client = ApiClient(options['base_url'], options['timeout'], recorder, started)
+        self.session_ids = []
+        self.created_project = False
+
+    def _think(self):
+        pause = self.random.uniform(self.options['think_min'], self.options['think_max'])
+        time.sleep(max(0.0, min(pause, self.deadline - time.monotonic())))
+
+    def _active(self):
+        return time.monotonic() < self.deadline
+
+    def run(self):
+        time.sleep(self.start_delay)
+        if not self._active():
+            return
+        self.recorder.user_started()
+        try:
+            username, password = self.credentials
+            status, payload = self.client.request('/login/', 'POST', '/login/', {"username": username, "password": password})
+            if status != 200 or not payload or 'token' not in payload:
+                return
+            self.client.token = payload['token']
+            if self.options['project_per_user'] and not self._create_project():
+                return
+            while self._active():
+                self._iteration()
+                self.recorder.iteration_finished()
+        finally:
+            self.client.close()
+            self.recorder.user_stopped()
+
+    def _create_project(self):
+        status, payload = self.client.request('/projects/', 'POST', '/projects/', {"name": f"Load test {self.name}"})
+        if status != 201 or not payload:
+            return False
+        self.project_id = payload['id']
+        self.created_project = True
+        return True
+
+    def _iteration(self):
+        project = f"/projects/{self.project_id}"
+        status, payload = self.client.request(
+            '/projects/{id}/sessions/', 'POST', f"{project}/sessions/", {"name": f"Load test {self.name}"}
+        )
+        if status != 201 or not payload:
+            self._think()
+            return
+        session_id = payload['id']
+        self.session_ids.append(session_id)
+        self._think()
+
+        for _ in range(self.options['messages']):
+            if not self._active():
+                return
+            self.client.request(
+                '/projects/{id}/sessions/{id}/chat/', 'POST', f"{project}/sessions/{session_id}/chat/",
+                {"message": self.random.choice(PROMPTS)},
+            )
+            self._think()
+
+        if not self._active():
+            return
+        self.client.request('/projects/{id}/sessions/{id}/messages/', 'GET', f"{project}/sessions/{session_id}/messages/")
+        self.client.request('/projects/{id}/sessions/', 'GET', f"{project}/sessions/")
+
+        if self.options['upload_ratio'] and self.random.random() < self.options['upload_ratio']:
+            self._think()
+            content = (f"Load test document from {self.name}.\n" * 64).encode('utf-8')
+            content = (content * (self.options['upload_kb'] * 1024 // len(content) + 1))[:self.options['upload_kb'] * 1024]
+            self.client.upload('/projects/{id}/upload/', f"{project}/upload/", f"loadtest-{uuid.uuid4().hex[:8]}.txt", content)
+        self._think()
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate concurrent chat users against a running deployment and report throughput, "
+        "error rates and latency percentiles per endpoint. Chat and upload requests reach "
+        "OpenAI and are billed like real traffic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000/api', help="API root of the target deployment.")
+        parser.add_argument('--users', type=int, default=10, help="Number of virtual users.")
+        parser.add_argument('--ramp-up', type=float, default=10.0, help="Seconds over which virtual users are started.")
+        parser.add_argument('--duration', type=float, default=60.0, help="Seconds to run, including the ramp-up.")
+        parser.add_argument('--think-min', type=float, default=1.0, help="Minimum pause between a user's actions (seconds).")
+        parser.add_argument('--think-max', type=float, default=3.0, help="Maximum pause between a user's actions (seconds).")
+        parser.add_argument('--messages', type=int, default=3, help="Messages each user sends per chat session.")
+        parser.add_argument('--upload-ratio', type=float, default=0.1, help="Share of iterations that also upload a file.")
+        parser.add_argument('--upload-kb', type=int, default=16, help="Size of uploaded files in KB.")
+        parser.add_argument('--project-id', type=int, default=None, help="Project to use; a new one is created if omitted.")
+        parser.add_argument(
+            '--project-per-user', action='store_true',
+            help="Give every virtual user its own project. Admission caps apply per user and per project, so "
+                 "combine with --create-users to measure the server rather than one tenant's caps.",
+        )
+        parser.add_argument('--username', default=None, help="Account shared by all virtual users.")
+        parser.add_argument('--password', default=None)
+        parser.add_argument(
+            '--create-users', action='store_true',
+            help="Create one account per virtual user in this Django database (target must share it). "
+                 "Refuses to run if loadtest-user-N accounts already exist, unless --reuse-users is given.",
+        )
+        parser.add_argument(
+            '--reuse-users', action='store_true',
+            help="With --create-users, log in to existing loadtest-user-N accounts with --password instead of "
+                 "refusing; their passwords are never changed.",
+        )
+        parser.add_argument(
+            '--cleanup', action='store_true',
+            help="Afterwards delete the sessions, any created projects, the accounts --create-users made "
+                 "and the tokens this run's logins issued.",
+        )
+        parser.add_argument('--timeout', type=float, default=120.0, help="Per-request timeout in seconds.")
+        parser.add_argument('--seed', type=int, default=None, help="Seed for reproducible prompts and think times.")
+        parser.add_argument('--output', default=None, help="Result file (JSON). Defaults to loadtest-<timestamp>.json.")
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['duration'] <= 0:
+            raise CommandError("--users and --duration must be positive.")
+        if options['think_min'] < 0 or options['think_max'] < options['think_min']:
+            raise CommandError("Think times must satisfy 0 <= --think-min <= --think-max.")
+        if options['project_per_user'] and options['project_id'] is not None:
+            raise CommandError("--project-per-user and --project-id cannot be combined.")
+        credentials, created_users = self._credentials(options)
+        run_started_at = timezone.now()
+        try:
+            started_at, result = self._load(options, credentials)
+        finally:
+            if options['cleanup'] and options['create_users']:
+                # Also when the run fails; after the API cleanup, which runs as the first of these accounts
+                self._delete_users(credentials, created_users, run_started_at)
+
+        self._print_report(result)
+        output = options['output'] or f"loadtest-{started_at:%Y%m%dT%H%M%S}.json"
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote results to {output}"))
+
+    def _load(self, options, credentials):
+        started_at = timezone.now()
+        recorder = Recorder()
+        started = time.monotonic()
+        admin = ApiClient(options['base_url'], options['timeout'], Recorder(), started)
+        admin.token = self._login(admin, credentials[0])
+        if options['project_per_user']:
+            project_id, created_project = None, False
+        else:
+            project_id, created_project = self._project(admin, options)
+
+        deadline = started + options['duration']
+        ramp_step = options['ramp_up'] / options['users']
+        users = [
+            VirtualUser(i, options, credentials[i % len(credentials)], project_id, recorder, started, i * ramp_step, deadline)
+            for i in range(options['users'])
+        ]
+        target = "one project per user" if options['project_per_user'] else f"project {project_id}"
+        self.stdout.write(
+            f"Running {len(users)} virtual users against {options['base_url']} ({target}) "
+            f"for {options['duration']:.0f}s with {options['ramp_up']:.0f}s ramp-up..."
+        )
+        timeline = self._run(users, recorder, started, deadline, options['timeout'])
+        elapsed = time.monotonic() - started
+
+        if options['cleanup']:
+            self._cleanup(admin, project_id, created_project, users)
+        admin.close()
+        return started_at, self._summarize(options, recorder, started_at, elapsed, timeline, project_id)
+
+    # --- Setup --- #
+    def _credentials(self, options):
+        """Returns (credentials, usernames of the accounts created by this run)."""
+        if options['create_users']:
+            User = get_user_model()
+            usernames = [f"loadtest-user-{i}" for i in range(options['users'])]
+            existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+            if existing and not options['reuse_users']:
+                raise CommandError(
+                    f"{len(existing)} loadtest-user-N accounts already exist. Pass --reuse-users with their "
+                    "--password to run as them, or delete them first."
+                )
+            if existing and not options['password']:
+                raise CommandError("--reuse-users needs the --password of the existing accounts.")
+            password = options['password'] or uuid.uuid4().hex
+            created_users = [username for username in usernames if username not in existing]
+            for username in created_users:
+                User.objects.create_user(username, password=password)
+            return [(username, password) for username in usernames], created_users
+        if options['reuse_users']:
+            raise CommandError("--reuse-users only applies to --create-users.")
+        if not options['username'] or not options['password']:
+            raise CommandError("Pass --username and --password, or --create-users.")
+        return [(options['username'], options['password'])], []
+
+    def _login(self, admin, credentials):
+        username, password = credentials
+        status, payload = admin.request('/login/', 'POST', '/login/', {"username": username, "password": password})
+        if status != 200 or not payload or 'token' not in payload:
+            raise CommandError(f"Could not log in to {admin.host} as {username} (status {status}).")
+        return payload['token']
+
+    def _project(self, admin, options):
+        if options['project_id'] is not None:
+            status, _ = admin.request('/projects/{id}/', 'GET', f"/projects/{options['project_id']}/")
+            if status != 200:
+                raise CommandError(f"Project {options['project_id']} is not accessible (status {status}).")
+            return options['project_id'], False
+        status, payload = admin.request('/projects/', 'POST', '/projects/', {"name": f"Load test {timezone.now():%Y-%m-%d %H:%M:%S}"})
+        if status != 201 or not payload:
+            raise CommandError(f"Could not create a load test project (status {status}).")
+        return payload['id'], True
+
+    def _cleanup(self, admin, project_id, created_project, users):
+        if created_project:
+            admin.request('/projects/{id}/', 'DELETE', f"/projects/{project_id}/")
+            return
+        for user in users:
+            if user.created_project:
+                admin.request('/projects/{id}/', 'DELETE', f"/projects/{user.project_id}/")
+                continue
+            for session_id in user.session_ids:
+                admin.request('/projects/{id}/sessions/{id}/', 'DELETE', f"/projects/{user.project_id}/sessions/{session_id}/")
+
+    def _delete_users(self, credentials, created_users, run_started_at):
+        # Reused accounts are kept, along with any token they had before; only tokens this run's logins issued go
+        reused = {username for username, _ in credentials} - set(created_users)
+        tokens, _ = Token.objects.filter(user__username__in=reused, created__gte=run_started_at).delete()
+        get_user_model().objects.filter(username__in=created_users).delete()
+        self.stdout.write(
+            f"Deleted {len(created_users)} load test accounts and {tokens} tokens issued to {len(reused)} reused accounts."
+        )
+
+    # --- Run --- #
+    def _run(self, users, recorder, started, deadline, timeout):
+        for user in users:
+            user.start()
+        timeline = []
+        seen = 0
+        second = 0
+        # Sample once per second until every user has finished its last request
+        while any(user.is_alive() for user in users) and time.monotonic() < deadline + timeout:
+            time.sleep(max(0.0, started + second + 1 - time.monotonic()))
+            second += 1
+            samples = recorder.samples[seen:]
+            seen += len(samples)
+            durations = sorted(sample[2] for sample in samples if sample[3] != 429)
+            errors = sum(1 for sample in samples if sample[4])
+            p95 = percentile(durations, 95)
+            timeline.append({
+                "second": second,
+                "active_users": recorder.active_users,
+                "requests": len(samples),
+                "rejected": sum(1 for sample in samples if sample[3] == 429),
+                "errors": errors,
+                "p95_ms": round(p95, 1) if p95 is not None else None,
+            })
+            if second % 10 == 0:
+                self.stdout.write(
+                    f"  t={second:>4}s  users={recorder.active_users:>4}  "
+                    f"requests={seen:>6}  last 1s p95={timeline[-1]['p95_ms']} ms"
+                )
+        return timeline
+
+    # --- Report --- #
+    def _latency(self, durations):
+        durations = sorted(durations)
+        if not durations:
+            return {}
+        latency = {
+            "min": round(durations[0], 1),
+            "mean": round(sum(durations) / len(durations), 1),
+        }
+        for pct in PERCENTILES:
+            latency[f"p{pct}"] = round(percentile(durations, pct), 1)
+        latency["max"] = round(durations[-1], 1)
+        return latency
+
+    def _admitted_latency(self, samples):
+        # Rejections return at once; counting them would make an overloaded server look fast
+        return self._latency(sample[2] for sample in samples if sample[3] != 429)
+
+    def _summarize(self, options, recorder, started_at, elapsed, timeline, project_id):
+        by_endpoint = defaultdict(list)
+        for sample in recorder.samples:
+            by_endpoint[sample[0]].append(sample)
+
+        endpoints = {}
+        for endpoint, samples in sorted(by_endpoint.items()):
+            errors = Counter(sample[4] for sample in samples if sample[4])
+            rejected = sum(1 for sample in samples if sample[3] == 429)
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "rejected": rejected,
+                "rejected_rate": round(rejected / len(samples), 4),
+                "errors": sum(errors.values()),
+                "error_rate": round(sum(errors.values()) / len(samples), 4),
+                "throughput_rps": round(len(samples) / elapsed, 2),
+                "latency_ms": self._admitted_latency(samples),
+                "status_codes": {str(code): count for code, count in Counter(sample[3] for sample in samples).items()},
+                "top_errors": dict(errors.most_common(5)),
+            }
+
+        total = len(recorder.samples)
+        total_errors = sum(1 for sample in recorder.samples if sample[4])
+        total_rejected = sum(1 for sample in recorder.samples if sample[3] == 429)
+        config = {key: options[key] for key in (
+            'base_url', 'users', 'ramp_up', 'duration', 'think_min', 'think_max', 'messages',
+            'upload_ratio', 'upload_kb', 'project_per_user', 'create_users', 'timeout', 'seed',
+        )}
+        return {
+            "started_at": started_at.isoformat(),
+            "elapsed_s": round(elapsed, 2),
+            "project_id": project_id,
+            "config": config,
+            "totals": {
+                "requests": total,
+                "rejected": total_rejected,
+                "rejected_rate": round(total_rejected / total, 4) if total else 0,
+                "errors": total_errors,
+                "error_rate": round(total_errors / total, 4) if total else 0,
+                "throughput_rps": round(total / elapsed, 2),
+                "iterations": recorder.iterations,
+                "latency_ms": self._admitted_latency(recorder.samples),
+            },
+            "endpoints": endpoints,
+            "timeline": timeline,
+        }
+
+    def _print_report(self, result):
+        header = f"{'Endpoint':<46} {'Reqs':>6} {'429%':>6} {'Err%':>6} {'RPS':>7} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'max':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        rows = list(result['endpoints'].items()) + [("TOTAL", result['totals'])]
+        for endpoint, stats in rows:
+            latency = stats['latency_ms']
+            self.stdout.write(
+                f"{endpoint:<46} {stats['requests']:>6} {stats['rejected_rate'] * 100:>5.1f}% "
+                f"{stats['error_rate'] * 100:>5.1f}% {stats['throughput_rps']:>7.2f} "
+                + ' '.join(f"{latency.get(key, 0):>8.0f}" for key in ('p50', 'p90', 'p95', 'p99', 'max'))
+            )
+        self.stdout.write(
+            f"Completed {result['totals']['iterations']} user iterations in {result['elapsed_s']:.1f}s "
+            "(latencies in ms, of admitted requests; 429s are admission rejections, not errors)."
+        )
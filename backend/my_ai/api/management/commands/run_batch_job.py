@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.batch import BatchJobBusy, BatchRunner
+from api.models import BatchJob
+from api.usage import BudgetExceeded
+from api.views import build_assistant_reply, client, get_or_create_assistant
+
+
+class Command(BaseCommand):
+    help = "Run or resume a batch question-answering job, writing NDJSON results to stdout."
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_id', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            job = BatchJob.objects.select_related('project', 'user').get(pk=options['job_id'])
+        except BatchJob.DoesNotExist:
+            raise CommandError(f"Batch job {options['job_id']} does not exist.")
+
+        runner = BatchRunner(job, client, get_or_create_assistant, build_assistant_reply)
+        try:
+            runner.start()
+        except (BudgetExceeded, BatchJobBusy) as e:
+            raise CommandError(str(e))
+
+        for result in runner.results():
+            self.stdout.write(json.dumps(result))
@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-19 05:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_usage_accounting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='fast_model',
+            field=models.CharField(choices=[('gpt-4o', 'GPT-4o (Recommended)'), ('gpt-4-turbo', 'GPT-4 Turbo'), ('gpt-3.5-turbo', 'GPT-3.5 Turbo'), ('gpt-4.1', 'GPT-4.1'), ('gpt-4.5-preview', 'GPT-4.5 Preview')], default='gpt-3.5-turbo', help_text='Faster model used for trivial messages and when the project model misses its latency SLO.', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='latency_slo_ms',
+            field=models.PositiveIntegerField(default=15000, help_text='Target run latency for the project model in adaptive routing mode.'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='routing_mode',
+            field=models.CharField(choices=[('fixed', 'Always use the project model'), ('adaptive', 'Choose a model per message')], default='fixed', help_text="'fixed' always uses the project model; 'adaptive' picks a model per message.", max_length=10),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-19 05:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_batch_jobs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session', 'timestamp'], name='api_chatmes_session_5a7a0f_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 05:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_chatmessage_session_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='tool_call_id',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='tool_name',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
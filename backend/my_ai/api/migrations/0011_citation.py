@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-19 05:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_chatmessage_tool_calls'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Citation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveSmallIntegerField()),
+                ('type', models.CharField(choices=[('file_citation', 'File citation'), ('file_path', 'File path')], default='file_citation', max_length=20)),
+                ('file_id', models.CharField(max_length=255)),
+                ('filename', models.CharField(blank=True, max_length=255, null=True)),
+                ('quote', models.TextField(blank=True)),
+                ('start_index', models.PositiveIntegerField()),
+                ('end_index', models.PositiveIntegerField()),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='citations', to='api.chatmessage')),
+            ],
+            options={
+                'ordering': ['message', 'number'],
+            },
+        ),
+    ]
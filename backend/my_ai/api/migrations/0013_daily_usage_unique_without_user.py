@@ -0,0 +1,39 @@
+# Generated by Django 5.2 on 2026-10-19 05:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def merge_duplicate_userless_rollups(apps, schema_editor):
+    """Fold duplicate user=NULL rows for the same project and day into one before the constraint exists."""
+    DailyUsage = apps.get_model('api', 'DailyUsage')
+    duplicates = (
+        DailyUsage.objects.filter(user__isnull=True)
+        .values('project_id', 'date')
+        .annotate(rows=models.Count('id'))
+        .filter(rows__gt=1)
+    )
+    fields = ['run_count', 'prompt_tokens', 'completion_tokens', 'total_duration_ms']
+    for duplicate in duplicates:
+        rows = list(DailyUsage.objects.filter(user__isnull=True, project_id=duplicate['project_id'], date=duplicate['date']).order_by('id'))
+        keep = rows[0]
+        for field in fields:
+            setattr(keep, field, sum(getattr(row, field) for row in rows))
+        keep.save(update_fields=fields)
+        DailyUsage.objects.filter(pk__in=[row.pk for row in rows[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_archived_session'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_userless_rollups, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailyusage',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('project', 'date'), name='unique_daily_usage_per_project_without_user'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 05:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_daily_usage_unique_without_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usagerecord',
+            name='archived_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
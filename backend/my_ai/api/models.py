@@ -1,4 +1,7 @@
+from django.conf import settings
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Substr
 
 # Define choices for the model field based on common availability
 # You might want to dynamically fetch this list or update it periodically
@@ -11,6 +14,16 @@ MODEL_CHOICES = [
     # Add other models as needed
 ]
 
+BUDGET_ACTION_CHOICES = [
+    ("reject", "Reject new messages"),
+    ("downgrade", "Downgrade to the fallback model"),
+]
+
+ROUTING_MODE_CHOICES = [
+    ("fixed", "Always use the project model"),
+    ("adaptive", "Choose a model per message"),
+]
+
 class Project(models.Model):
     name = models.CharField(max_length=255)
     # Store the OpenAI Vector Store ID associated with this project
@@ -24,6 +37,35 @@ class Project(models.Model):
         default="gpt-4o",
         help_text="The OpenAI model used by the assistant for this project."
     )
+    # Optional monthly token budget (prompt + completion tokens); null means unlimited
+    monthly_token_budget = models.PositiveBigIntegerField(
+        blank=True,
+        null=True,
+        help_text="Maximum prompt + completion tokens per calendar month. Leave empty for no limit."
+    )
+    budget_exceeded_action = models.CharField(
+        max_length=10,
+        choices=BUDGET_ACTION_CHOICES,
+        default='reject',
+        help_text="What to do with new messages once the monthly token budget is exhausted."
+    )
+    # Optional per-message model routing (see api/routing.py)
+    routing_mode = models.CharField(
+        max_length=10,
+        choices=ROUTING_MODE_CHOICES,
+        default='fixed',
+        help_text="'fixed' always uses the project model; 'adaptive' picks a model per message."
+    )
+    fast_model = models.CharField(
+        max_length=50,
+        choices=MODEL_CHOICES,
+        default="gpt-3.5-turbo",
+        help_text="Faster model used for trivial messages and when the project model misses its latency SLO."
+    )
+    latency_slo_ms = models.PositiveIntegerField(
+        default=15000,
+        help_text="Target run latency for the project model in adaptive routing mode."
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -40,6 +82,42 @@ class UploadedFile(models.Model):
     def __str__(self):
         return f"{self.filename} (Project: {self.project.name})"
 
+# Characters of the last message returned as a preview in session listings
+SESSION_PREVIEW_CHARS = 120
+
+class ChatSessionQuerySet(models.QuerySet):
+    def with_activity(self):
+        """
+        Annotate message_count, last_message_at, last_message_preview and
+        last_activity_at with correlated subqueries, so a session listing stays
+        a single query however many sessions and messages there are.
+        Archived sessions have no hot messages and report their archive's summary.
+        Tool-call records are bookkeeping, not conversation: they count as activity
+        but not as messages, and never become the preview.
+        """
+        messages = ChatMessage.objects.filter(session=OuterRef('pk'))
+        conversation = messages.exclude(role='tool')
+        latest = messages.order_by('-timestamp', '-id')
+        return self.annotate(
+            message_count=Coalesce(
+                Subquery(conversation.order_by().values('session').annotate(count=Count('id')).values('count')),
+                'archive__message_count',
+                0,
+                output_field=models.IntegerField(),
+            ),
+            last_message_at=Coalesce(
+                Subquery(latest.values('timestamp')[:1]),
+                'archive__last_message_at',
+            ),
+            last_message_preview=Coalesce(
+                Subquery(conversation.order_by('-timestamp', '-id').annotate(preview=Substr('content', 1, SESSION_PREVIEW_CHARS)).values('preview')[:1]),
+                'archive__last_message_preview',
+                output_field=models.TextField(),
+            ),
+        ).annotate(
+            last_activity_at=Coalesce('last_message_at', 'created_at'),
+        )
+
 class ChatSession(models.Model):
     project = models.ForeignKey(Project, related_name='chat_sessions', on_delete=models.CASCADE)
     # Store the OpenAI Thread ID
@@ -48,6 +126,8 @@ class ChatSession(models.Model):
     # Optional: Store a name or summary for the session
     name = models.CharField(max_length=255, blank=True, null=True)
 
+    objects = ChatSessionQuerySet.as_manager()
+
     def __str__(self):
         return f"Chat Session {self.id} (Project: {self.project.name})"
 
@@ -55,16 +135,178 @@ class ChatMessage(models.Model):
     ROLE_CHOICES = [
         ('user', 'User'),
         ('assistant', 'Assistant'),
+        ('tool', 'Tool'),
     ]
     session = models.ForeignKey(ChatSession, related_name='messages', on_delete=models.CASCADE)
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Set on 'tool' messages: the function call they answer (content holds its arguments and output as JSON)
+    tool_call_id = models.CharField(max_length=255, blank=True, null=True)
+    tool_name = models.CharField(max_length=100, blank=True, null=True)
     # Optional: Store OpenAI message ID if needed for correlation
     # openai_message_id = models.CharField(max_length=255, blank=True, null=True)
 
     class Meta:
         ordering = ['timestamp'] # Ensure messages are ordered chronologically
+        indexes = [
+            # Serves per-session history listings and the latest-message subqueries
+            models.Index(fields=['session', 'timestamp']),
+        ]
 
     def __str__(self):
         return f"{self.role.capitalize()} message in Session {self.session.id} at {self.timestamp}"
+
+class Citation(models.Model):
+    """A numbered file citation in an assistant message; start/end index locate its "[n]" marker in the content."""
+    TYPE_CHOICES = [
+        ('file_citation', 'File citation'),
+        ('file_path', 'File path'),
+    ]
+    message = models.ForeignKey(ChatMessage, related_name='citations', on_delete=models.CASCADE)
+    number = models.PositiveSmallIntegerField()
+    type = models.CharField(max_length=20, choices=TYPE_CHOICES, default='file_citation')
+    file_id = models.CharField(max_length=255)
+    filename = models.CharField(max_length=255, blank=True, null=True)
+    quote = models.TextField(blank=True)
+    start_index = models.PositiveIntegerField()
+    end_index = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['message', 'number']
+
+    def __str__(self):
+        return f"[{self.number}] {self.filename or self.file_id} in message {self.message_id}"
+
+class ArchivedSession(models.Model):
+    """
+    Cold storage for an idle session's messages: one compressed block holding the
+    session's message list exactly as the messages API renders it. While a session
+    is archived it has no ChatMessage/Citation rows (see api/archive.py).
+    """
+    session = models.OneToOneField(ChatSession, related_name='archive', on_delete=models.CASCADE)
+    codec = models.CharField(max_length=10)
+    data = models.BinaryField()
+    message_count = models.PositiveIntegerField()
+    last_message_at = models.DateTimeField(blank=True, null=True)
+    last_message_preview = models.TextField(blank=True, null=True)
+    raw_bytes = models.PositiveIntegerField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archive of Session {self.session_id} ({self.message_count} messages, {self.codec})"
+
+# --- Usage Accounting --- #
+class UsageRecord(models.Model):
+    """One row per assistant run: the raw ledger the daily rollups are built from."""
+    project = models.ForeignKey(Project, related_name='usage_records', on_delete=models.CASCADE)
+    session = models.ForeignKey(ChatSession, related_name='usage_records', on_delete=models.SET_NULL, blank=True, null=True)
+    message = models.OneToOneField(ChatMessage, related_name='usage', on_delete=models.SET_NULL, blank=True, null=True)
+    # The message's id while its session is archived (the row is gone, so `message` is NULL); rehydrating links it back
+    archived_message_id = models.BigIntegerField(blank=True, null=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='usage_records', on_delete=models.SET_NULL, blank=True, null=True)
+    model = models.CharField(max_length=50)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    duration_ms = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.prompt_tokens}+{self.completion_tokens} tokens on {self.model} (Project: {self.project_id})"
+
+class DailyUsage(models.Model):
+    """Per-day rollup per project and user, maintained incrementally as runs are recorded."""
+    project = models.ForeignKey(Project, related_name='daily_usage', on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='daily_usage', on_delete=models.SET_NULL, blank=True, null=True)
+    date = models.DateField()
+    run_count = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    total_duration_ms = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'user', 'date'], name='unique_daily_usage_per_project_user'),
+            # NULLs are distinct in the constraint above, so runs without a user need their own.
+            # (A partial index rather than nulls_distinct=False, which only PostgreSQL 15+ enforces.)
+            models.UniqueConstraint(
+                fields=['project', 'date'], condition=models.Q(user__isnull=True),
+                name='unique_daily_usage_per_project_without_user',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['project', 'date']),
+        ]
+
+    def __str__(self):
+        return f"Usage for Project {self.project_id} on {self.date}"
+
+# --- Batch Question Answering --- #
+class BatchJob(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+    ]
+    project = models.ForeignKey(Project, related_name='batch_jobs', on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='batch_jobs', on_delete=models.SET_NULL, blank=True, null=True)
+    name = models.CharField(max_length=255, blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    concurrency = models.PositiveSmallIntegerField(default=8)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    # Updated periodically while a runner is alive; lets a resumed run tell a crashed runner from a live one
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    # Seconds spent actively running, summed across resumed runs
+    run_seconds = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Batch Job {self.id} (Project: {self.project_id})"
+
+    def get_progress(self):
+        """Question counts per status plus throughput over the time spent running."""
+        counts = dict(self.questions.order_by().values_list('status').annotate(count=models.Count('id')))
+        finished = counts.get('done', 0) + counts.get('failed', 0)
+        return {
+            "total": sum(counts.values()),
+            "done": counts.get('done', 0),
+            "failed": counts.get('failed', 0),
+            "pending": counts.get('pending', 0) + counts.get('running', 0),
+            "run_seconds": round(self.run_seconds, 1),
+            "questions_per_minute": round(finished * 60 / self.run_seconds, 1) if self.run_seconds else None,
+        }
+
+class BatchQuestion(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    job = models.ForeignKey(BatchJob, related_name='questions', on_delete=models.CASCADE)
+    index = models.PositiveIntegerField()
+    question = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    answer = models.TextField(blank=True, default='')
+    citations = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True, default='')
+    model = models.CharField(max_length=50, blank=True, default='')
+    duration_ms = models.PositiveIntegerField(blank=True, null=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['index']
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'index'], name='unique_batch_question_index'),
+        ]
+        indexes = [
+            models.Index(fields=['job', 'status']),
+        ]
+
+    def __str__(self):
+        return f"Question {self.index} of Batch Job {self.job_id}"
@@ -0,0 +1,327 @@
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import CachedTokenAuthentication
+
+logger = logging.getLogger(__name__)
+
+# Defaults for request profiling; override via settings.REQUEST_PROFILING
+REQUEST_PROFILING_DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.01,  # Share of requests profiled at random
+    'HEADER': 'X-Profile-Request',  # Requests with a staff user's API token carrying this header are always profiled
+    'HEADER_TOKEN': None,  # When set, a header value matching it is honoured for any client
+    'LATENCY_THRESHOLD_MS': None,  # Keep the profile of any request slower than this (tracks every request)
+    'INTERVAL_MS': 5,  # Stack sampling interval
+    'MAX_STACK_DEPTH': 64,
+    'DIRECTORY': os.path.join(settings.BASE_DIR, 'profiles'),
+    'MAX_PROFILES': 200,  # Oldest profiles are deleted beyond this many
+}
+
+
+def get_profiling_settings():
+    return {**REQUEST_PROFILING_DEFAULTS, **getattr(settings, 'REQUEST_PROFILING', {})}
+
+
+def _short_path(path):
+    base_dir = str(settings.BASE_DIR)
+    if path.startswith(base_dir):
+        return os.path.relpath(path, base_dir)
+    marker = 'site-packages' + os.sep
+    if marker in path:
+        return path.split(marker, 1)[1]
+    return path
+
+
+class StackSampler:
+    """
+    Statistical profiler shared by every profiled request in the process.
+
+    A single daemon thread wakes every `interval` seconds, grabs the current frame
+    of each tracked request thread via sys._current_frames() and counts the
+    collapsed stack. The thread only runs while at least one request is tracked,
+    and the cost per tick is independent of how deep the request's code is.
+    """
+
+    def __init__(self):
+        self._tracked = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._frame_names = {}
+
+    def _frame_name(self, code, lineno):
+        key = (code, lineno)
+        name = self._frame_names.get(key)
+        if name is None:
+            name = f"{code.co_name} ({_short_path(code.co_filename)}:{lineno})"
+            if len(self._frame_names) < 50000:
+                self._frame_names[key] = name
+        return name
+
+    def _collapse(self, frame, max_depth):
+        names = []
+        while frame is not None and len(names) < max_depth:
+            names.append(self._frame_name(frame.f_code, frame.f_lineno))
+            frame = frame.f_back
+        names.reverse()
+        return ';'.join(names)
+
+    def _run(self, interval, max_depth):
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._tracked:
+                    self._thread = None
+                    return
+                tracked = list(self._tracked.items())
+            frames = sys._current_frames()
+            for thread_id, counter in tracked:
+                frame = frames.get(thread_id)
+                if frame is not None and thread_id != me:
+                    counter[self._collapse(frame, max_depth)] += 1
+            del frames
+            time.sleep(interval)
+
+    def track(self, thread_id, interval, max_depth):
+        counter = Counter()
+        with self._lock:
+            self._tracked[thread_id] = counter
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(interval, max_depth), name='request-profiler', daemon=True)
+                self._thread.start()
+        return counter
+
+    def untrack(self, thread_id):
+        with self._lock:
+            return self._tracked.pop(thread_id, Counter())
+
+
+sampler = StackSampler()
+
+
+# --- On-disk profile store --- #
+class ProfileStore:
+    """Profiles as one JSON file each in a directory, capped at MAX_PROFILES (oldest deleted first)."""
+
+    def __init__(self, directory, max_profiles):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def _paths(self):
+        if not os.path.isdir(self.directory):
+            return []
+        # File names start with a sortable timestamp, so name order is age order
+        return sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.json')
+        )
+
+    def save(self, profile):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{profile['id']}.json")
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(profile, f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            paths = self._paths()
+            for stale in paths[:max(0, len(paths) - self.max_profiles)]:
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+
+    def load(self, profile_id):
+        # Profile ids are generated by us; reject anything that could escape the directory
+        if os.sep in profile_id or profile_id.startswith('.'):
+            return None
+        try:
+            with open(os.path.join(self.directory, f"{profile_id}.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def iter_profiles(self):
+        for path in reversed(self._paths()):
+            try:
+                with open(path) as f:
+                    yield json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+
+
+def get_profile_store():
+    config = get_profiling_settings()
+    return ProfileStore(config['DIRECTORY'], config['MAX_PROFILES'])
+
+
+def summarize(profile):
+    """Profile metadata without the stacks, for listings."""
+    return {key: value for key, value in profile.items() if key != 'stacks'}
+
+
+def to_collapsed(profile):
+    """Brendan Gregg's collapsed-stack format, readable by flamegraph.pl and speedscope."""
+    return ''.join(f"{stack} {count}\n" for stack, count in profile['stacks'].items())
+
+
+def hot_frames(profiles, limit=20):
+    """
+    Aggregate frames per view across profiles. `self` counts samples where the frame
+    was executing (top of stack); `total` counts samples where it was anywhere on the stack.
+    """
+    views = {}
+    for profile in profiles:
+        view = views.setdefault(profile.get('view') or profile['path'], {
+            'profiles': 0, 'samples': 0, 'self': Counter(), 'total': Counter(),
+        })
+        view['profiles'] += 1
+        for stack, count in profile['stacks'].items():
+            frames = stack.split(';')
+            view['samples'] += count
+            view['self'][frames[-1]] += count
+            for frame in set(frames):
+                view['total'][frame] += count
+
+    result = []
+    for name, view in sorted(views.items(), key=lambda item: -item[1]['samples']):
+        samples = view['samples'] or 1
+        result.append({
+            'view': name,
+            'profiles': view['profiles'],
+            'samples': view['samples'],
+            'self': [
+                {'frame': frame, 'samples': count, 'percent': round(count * 100 / samples, 1)}
+                for frame, count in view['self'].most_common(limit)
+            ],
+            'total': [
+                {'frame': frame, 'samples': count, 'percent': round(count * 100 / samples, 1)}
+                for frame, count in view['total'].most_common(limit)
+            ],
+        })
+    return result
+
+
+# --- Middleware --- #
+class SampledProfilingMiddleware:
+    """
+    Opt-in request profiler. A request is profiled when it is picked at random
+    (SAMPLE_RATE), carries the profiling header (with a staff user's API token,
+    or with HEADER_TOKEN as its value), or (with LATENCY_THRESHOLD_MS set) turns out
+    slower than the threshold. Streamed responses are profiled until the stream
+    closes. Profiles go to the on-disk store.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = get_profiling_settings()
+        self.store = ProfileStore(self.config['DIRECTORY'], self.config['MAX_PROFILES'])
+        self.header_key = 'HTTP_' + self.config['HEADER'].upper().replace('-', '_')
+
+    def _header_authorized(self, request):
+        """
+        Whether to honour the profiling header: with HEADER_TOKEN as its value, or on a request
+        carrying a staff user's API token. Decided before anything is tracked, so clients without
+        such credentials cannot add sampling load by sending the header.
+        """
+        value = request.META.get(self.header_key)
+        if value is None:
+            return False
+        token = self.config['HEADER_TOKEN']
+        if token is not None and constant_time_compare(value, token):
+            return True
+        return self._has_staff_token(request)
+
+    @staticmethod
+    def _has_staff_token(request):
+        # Authentication proper runs later, in the view; this is the same (cached) token lookup
+        auth = request.META.get('HTTP_AUTHORIZATION', '').split()
+        if len(auth) != 2 or auth[0] != CachedTokenAuthentication.keyword:
+            return False
+        try:
+            user, _ = CachedTokenAuthentication().authenticate_credentials(auth[1])
+        except AuthenticationFailed:
+            return False
+        return user.is_staff
+
+    def __call__(self, request):
+        if not self.config['ENABLED']:
+            return self.get_response(request)
+
+        reason = None
+        if self._header_authorized(request):
+            reason = 'header'
+        elif random.random() < self.config['SAMPLE_RATE']:
+            reason = 'sampled'
+        if reason is None and self.config['LATENCY_THRESHOLD_MS'] is None:
+            return self.get_response(request)
+
+        thread_id = threading.get_ident()
+        sampler.track(thread_id, self.config['INTERVAL_MS'] / 1000, self.config['MAX_STACK_DEPTH'])
+        started_at = timezone.now()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            sampler.untrack(thread_id)
+            raise
+
+        finish = functools.partial(self._finish, request, response, thread_id, reason, started_at, started)
+        if response.streaming and not response.is_async:
+            # A streamed body is generated as the server iterates it, after this returns: keep sampling until it closes.
+            # (Async bodies run on the event loop, not this thread, so those profiles cover the view only.)
+            response.streaming_content = self._stream(response.streaming_content, finish)
+        else:
+            finish()
+        return response
+
+    @staticmethod
+    def _stream(content, finish):
+        try:
+            yield from content
+        finally:
+            # Also runs when the server closes the response early (e.g. the client went away)
+            finish()
+
+    def _finish(self, request, response, thread_id, reason, started_at, started):
+        stacks = sampler.untrack(thread_id)
+        duration_ms = (time.perf_counter() - started) * 1000
+        threshold = self.config['LATENCY_THRESHOLD_MS']
+        if reason is None and threshold is not None and duration_ms >= threshold:
+            reason = 'slow'
+        if reason is not None and stacks:
+            self._save(request, response, stacks, reason, started_at, duration_ms, self.config['INTERVAL_MS'])
+
+    def _save(self, request, response, stacks, reason, started_at, duration_ms, interval_ms):
+        match = getattr(request, 'resolver_match', None)
+        profile = {
+            'id': f"{started_at.strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}",
+            'started_at': started_at.isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 1),
+            'reason': reason,
+            'interval_ms': interval_ms,
+            'samples': sum(stacks.values()),
+            'stacks': dict(stacks),
+        }
+        try:
+            self.store.save(profile)
+            logger.info(f"Saved {reason} profile {profile['id']} for {request.method} {request.path} ({duration_ms:.0f} ms)")
+        except OSError as e:
+            logger.error(f"Failed to save request profile: {e}")
@@ -0,0 +1,139 @@
+import logging
+import math
+import random
+import re
+import threading
+from collections import deque
+
+from django.conf import settings
+
+from .models import UsageRecord
+
+logger = logging.getLogger(__name__)
+
+# Defaults for adaptive routing; override via settings.MODEL_ROUTING
+MODEL_ROUTING_DEFAULTS = {
+    'SHORT_MESSAGE_CHARS': 280,  # Messages at or below this length are candidates for the fast model
+    'WINDOW': 50,  # Recent runs per model used for latency/error statistics
+    'MIN_SAMPLES': 5,  # Observations needed before a model's statistics are trusted
+    'LATENCY_PERCENTILE': 0.9,  # Percentile compared against the project's latency SLO
+    'MAX_ERROR_RATE': 0.2,  # Error rate above which a model is considered unhealthy
+    'PROBE_RATE': 0.1,  # Share of messages still sent to a degraded primary so it can recover
+}
+
+# Phrases suggesting the answer has to come from the project's files
+FILE_SEARCH_HINTS = re.compile(
+    r"\b(file|files|document|documents|doc|docs|pdf|report|attachment|upload(ed)?|source|sources|cite|citation|"
+    r"according to|page|section|table|policy|manual)\b",
+    re.IGNORECASE,
+)
+# Signals of a question that needs the stronger model regardless of length
+COMPLEXITY_HINTS = re.compile(
+    r"```|\b(explain|analy[sz]e|compare|summari[sz]e|step[- ]by[- ]step|why|derive|prove|write|draft|refactor)\b",
+    re.IGNORECASE,
+)
+
+
+def get_routing_settings():
+    return {**MODEL_ROUTING_DEFAULTS, **getattr(settings, 'MODEL_ROUTING', {})}
+
+
+class ModelStats:
+    """Rolling per-model latency and error observations for this process."""
+
+    def __init__(self, window):
+        self._runs = {}
+        self._seeded = set()
+        self._window = window
+        self._lock = threading.Lock()
+
+    def _seed(self, model):
+        # Warm a cold process from the usage ledger so routing is informed from the first message
+        durations = list(
+            UsageRecord.objects.filter(model=model).order_by('-created_at').values_list('duration_ms', flat=True)[:self._window]
+        )
+        with self._lock:
+            if model in self._seeded:
+                return
+            self._seeded.add(model)
+            runs = self._runs.setdefault(model, deque(maxlen=self._window))
+            runs.extendleft((duration, True) for duration in durations)
+
+    def record(self, model, duration_ms, ok):
+        with self._lock:
+            self._runs.setdefault(model, deque(maxlen=self._window)).append((duration_ms, ok))
+
+    def snapshot(self, model):
+        if model not in self._seeded:
+            self._seed(model)
+        with self._lock:
+            return list(self._runs.get(model, ()))
+
+    def reset(self):
+        with self._lock:
+            self._runs.clear()
+            self._seeded.clear()
+
+
+model_stats = ModelStats(window=get_routing_settings()['WINDOW'])
+
+
+def record_run_outcome(model, duration_ms, ok):
+    model_stats.record(model, duration_ms, ok)
+
+
+def _latency_percentile(runs, percentile):
+    durations = sorted(duration for duration, ok in runs if ok)
+    if not durations:
+        return None
+    # Nearest-rank: the smallest duration with at least `percentile` of the runs at or below it
+    return durations[max(0, math.ceil(percentile * len(durations)) - 1)]
+
+
+def _health(model, config):
+    """Return (latency_at_percentile, error_rate) or None while there are too few samples."""
+    runs = model_stats.snapshot(model)
+    if len(runs) < config['MIN_SAMPLES']:
+        return None
+    error_rate = sum(1 for _, ok in runs if not ok) / len(runs)
+    return _latency_percentile(runs, config['LATENCY_PERCENTILE']), error_rate
+
+
+def needs_file_search(project, message):
+    return bool(project.openai_vector_store_id) and bool(FILE_SEARCH_HINTS.search(message))
+
+
+def choose_model(project, message):
+    """
+    Pick the model for one message of an adaptive-routing project.
+    Returns (model, reason). Projects in 'fixed' mode always get their own model.
+    """
+    primary, fast = project.model, project.fast_model
+    if project.routing_mode != 'adaptive' or primary == fast:
+        return primary, "fixed"
+
+    config = get_routing_settings()
+    is_short = len(message) <= config['SHORT_MESSAGE_CHARS']
+    if is_short and not needs_file_search(project, message) and not COMPLEXITY_HINTS.search(message):
+        return fast, "trivial message"
+
+    primary_health = _health(primary, config)
+    if primary_health is None:
+        return primary, "primary model (insufficient latency data)"
+
+    latency, error_rate = primary_health
+    primary_degraded = error_rate > config['MAX_ERROR_RATE'] or (latency is not None and latency > project.latency_slo_ms)
+    if not primary_degraded:
+        return primary, "primary model within SLO"
+
+    if random.random() < config['PROBE_RATE']:
+        return primary, "probing degraded primary model"
+
+    fast_health = _health(fast, config)
+    if fast_health is not None and fast_health[1] > config['MAX_ERROR_RATE']:
+        return primary, "primary model degraded but fallback is unhealthy"
+    logger.warning(
+        f"Model {primary} for project {project.id} is missing its SLO "
+        f"(p{int(config['LATENCY_PERCENTILE'] * 100)}={latency} ms, errors={error_rate:.0%}). Falling back to {fast}."
+    )
+    return fast, "primary model missed latency SLO"
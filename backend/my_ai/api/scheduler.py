@@ -0,0 +1,290 @@
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the run scheduler; override via settings.RUN_SCHEDULER
+RUN_SCHEDULER_DEFAULTS = {
+    'ENABLED': True,
+    'MAX_CONCURRENT': 8,  # Interactive OpenAI runs/uploads in flight per process
+    'MAX_QUEUE_DEPTH': 64,  # Waiting requests per process before new ones are rejected
+    'MAX_ACTIVE_PER_TENANT': 4,  # In-flight requests per user or project, so one tenant cannot hold every slot
+    'MAX_QUEUED_PER_TENANT': 4,  # Waiting requests per user or project before new ones are rejected
+    'QUEUE_TIMEOUT': 30,  # Seconds a request may wait for admission before it is rejected
+    # Background (batch) work runs in its own lower-priority lane with its own slots: it is only admitted when
+    # no interactive request is eligible, holds at most this many slots in total and per user or project, and
+    # never counts against the interactive limits above. It still shares the org rate limits below. Sized to
+    # BATCH_JOBS['MAX_CONCURRENCY'], a batch job runs with min(its concurrency, these caps) workers
+    'BATCH_MAX_CONCURRENT': 16,
+    'BATCH_MAX_ACTIVE_PER_TENANT': 16,
+    'WORKER_PROCESSES': 1,  # Org rate limits are split evenly across this many processes
+    'DEFAULT_TPM_ESTIMATE': 1500,  # Tokens reserved per run on top of the message length estimate
+    'PROJECT_WEIGHTS': {},  # {project_id: weight}; heavier weights get a larger share
+    # Per-model org limits (requests and tokens per minute); 'default' covers unlisted models
+    'RATE_LIMITS': {
+        'default': {'rpm': 500, 'tpm': 30000},
+        'files': {'rpm': 100, 'tpm': None},
+    },
+}
+
+
+def get_scheduler_settings():
+    return {**RUN_SCHEDULER_DEFAULTS, **getattr(settings, 'RUN_SCHEDULER', {})}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `capacity` per minute. Not thread-safe on its own."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` can be consumed (requests larger than the bucket only need it full)."""
+        self._refill()
+        needed = min(amount, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount):
+        # Negative refunds record tokens used beyond the estimate as debt
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+
+class Ticket:
+    def __init__(self, seq, user_key, project_key, model, tokens, weight, tag, lane=INTERACTIVE):
+        self.seq = seq
+        self.lane = lane
+        self.user_key = user_key
+        self.project_key = project_key
+        self.model = model
+        self.tokens = tokens
+        self.weight = weight
+        self.tag = tag
+        self.enqueued_at = time.monotonic()
+        self.admitted_at = None
+        self.used_tokens = None
+
+    @property
+    def wait_ms(self):
+        if self.admitted_at is None:
+            return 0
+        return int((self.admitted_at - self.enqueued_at) * 1000)
+
+
+class RunScheduler:
+    """
+    Admission control in front of OpenAI calls.
+
+    Requests are ordered by self-clocked weighted fair queueing: each ticket's
+    finish tag advances the virtual clock of both its user and its project, so a
+    tenant with a backlog queues behind itself while light tenants go first. A
+    ticket is admitted once it is the lowest-tag waiter whose model has RPM/TPM
+    budget and a concurrency slot is free.
+
+    Batch tickets form a second lane with separate finish tags, slots and caps;
+    they are only considered when no interactive ticket can be admitted, so
+    bulk work can never crowd interactive requests out of a tenant's share or
+    out of the process's interactive slots.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_scheduler_settings()
+        self._cond = threading.Condition()
+        self._queue = []
+        self._active = 0
+        # Keyed by (lane, tenant) so batch work never uses up a tenant's interactive allowance
+        self._active_lanes = Counter()
+        self._active_users = Counter()
+        self._active_projects = Counter()
+        self._virtual_time = 0.0
+        self._user_finish = {}
+        self._project_finish = {}
+        self._buckets = {}
+        self._seq = itertools.count()
+        self._avg_hold = 5.0  # Seconds; EWMA of how long admitted tickets hold a slot
+
+    # --- Rate limit buckets --- #
+    def _buckets_for(self, model):
+        if model not in self._buckets:
+            limits = self.config['RATE_LIMITS']
+            limit = limits.get(model, limits['default'])
+            share = max(1, self.config['WORKER_PROCESSES'])
+            self._buckets[model] = tuple(
+                TokenBucket(limit[key] / share) if limit.get(key) else None for key in ('rpm', 'tpm')
+            )
+        return self._buckets[model]
+
+    def _rate_wait(self, ticket):
+        rpm, tpm = self._buckets_for(ticket.model)
+        waits = [0.0]
+        if rpm is not None:
+            waits.append(rpm.wait_time(1))
+        if tpm is not None and ticket.tokens:
+            waits.append(tpm.wait_time(ticket.tokens))
+        return max(waits)
+
+    # --- Queue bookkeeping --- #
+    def _reject(self, message, ticket_desc):
+        backlog = sum(1 for t in self._queue if t.lane == INTERACTIVE) + self._active_lanes[INTERACTIVE]
+        retry_after = max(1, math.ceil(backlog * self._avg_hold / max(1, self.config['MAX_CONCURRENT'])))
+        logger.warning(f"Rejected {ticket_desc}: {message} (queued={len(self._queue)}, active={self._active}, retry_after={retry_after}s)")
+        return AdmissionRejected(message, retry_after)
+
+    def _next_eligible(self):
+        """Lowest-tag waiter whose model has rate budget, plus the shortest rate wait otherwise."""
+        shortest_wait = None
+        for ticket in sorted(self._queue, key=lambda t: (t.lane == BATCH, t.tag, t.seq)):
+            if ticket.lane == BATCH:
+                slots, per_tenant = self.config['BATCH_MAX_CONCURRENT'], self.config['BATCH_MAX_ACTIVE_PER_TENANT']
+            else:
+                slots, per_tenant = self.config['MAX_CONCURRENT'], self.config['MAX_ACTIVE_PER_TENANT']
+            if self._active_lanes[ticket.lane] >= slots:
+                continue
+            if (self._active_users[(ticket.lane, ticket.user_key)] >= per_tenant
+                    or self._active_projects[(ticket.lane, ticket.project_key)] >= per_tenant):
+                continue
+            wait = self._rate_wait(ticket)
+            if wait == 0:
+                return ticket, None
+            shortest_wait = wait if shortest_wait is None else min(shortest_wait, wait)
+        return None, shortest_wait
+
+    def acquire(self, user_key, project_key, model, tokens=0, lane=INTERACTIVE):
+        if not self.config['ENABLED']:
+            ticket = Ticket(next(self._seq), user_key, project_key, model, tokens, 1, 0.0, lane)
+            ticket.admitted_at = ticket.enqueued_at
+            return ticket
+
+        weight = self.config['PROJECT_WEIGHTS'].get(project_key, 1) or 1
+        cost = max(1, tokens)
+        with self._cond:
+            if lane == INTERACTIVE:
+                # Queue limits protect interactive latency; batch callers bound their own concurrency
+                waiting = [t for t in self._queue if t.lane == INTERACTIVE]
+                if len(waiting) >= self.config['MAX_QUEUE_DEPTH']:
+                    raise self._reject("Server is busy, please retry shortly.", f"{model} request for project {project_key}")
+                per_tenant = self.config['MAX_QUEUED_PER_TENANT']
+                if (sum(1 for t in waiting if t.user_key == user_key) >= per_tenant
+                        or sum(1 for t in waiting if t.project_key == project_key) >= per_tenant):
+                    raise self._reject("Too many requests queued for this user or project.", f"{model} request for project {project_key}")
+
+            user_lane, project_lane = (lane, user_key), (lane, project_key)
+            start = max(self._virtual_time, self._user_finish.get(user_lane, 0.0), self._project_finish.get(project_lane, 0.0))
+            ticket = Ticket(next(self._seq), user_key, project_key, model, tokens, weight, start + cost / weight, lane)
+            self._user_finish[user_lane] = ticket.tag
+            self._project_finish[project_lane] = ticket.tag
+            self._queue.append(ticket)
+
+            deadline = ticket.enqueued_at + self.config['QUEUE_TIMEOUT']
+            while True:
+                eligible, timeout = self._next_eligible()
+                if eligible is ticket:
+                    self._admit(ticket)
+                    return ticket
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()
+                    raise self._reject("Timed out waiting for capacity, please retry shortly.", f"{model} request for project {project_key}")
+                self._cond.wait(remaining if timeout is None else min(remaining, timeout))
+
+    def _admit(self, ticket):
+        self._queue.remove(ticket)
+        self._active += 1
+        self._active_lanes[ticket.lane] += 1
+        self._active_users[(ticket.lane, ticket.user_key)] += 1
+        self._active_projects[(ticket.lane, ticket.project_key)] += 1
+        if ticket.lane == INTERACTIVE:
+            # Batch tags live on their own clock; advancing the shared one would delay interactive tenants
+            self._virtual_time = max(self._virtual_time, ticket.tag)
+        rpm, tpm = self._buckets_for(ticket.model)
+        if rpm is not None:
+            rpm.consume(1)
+        if tpm is not None and ticket.tokens:
+            tpm.consume(ticket.tokens)
+        ticket.admitted_at = time.monotonic()
+        # Let the next waiter re-check now that the queue head changed
+        self._cond.notify_all()
+
+    def release(self, ticket):
+        """Free the ticket's slot and settle its token reservation against `ticket.used_tokens`."""
+        if not self.config['ENABLED']:
+            return
+        with self._cond:
+            self._active -= 1
+            self._active_lanes[ticket.lane] -= 1
+            user_lane, project_lane = (ticket.lane, ticket.user_key), (ticket.lane, ticket.project_key)
+            self._active_users[user_lane] -= 1
+            self._active_projects[project_lane] -= 1
+            if self._active_users[user_lane] <= 0:
+                del self._active_users[user_lane]
+            if self._active_projects[project_lane] <= 0:
+                del self._active_projects[project_lane]
+            held = time.monotonic() - ticket.admitted_at
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+            _, tpm = self._buckets_for(ticket.model)
+            if tpm is not None and ticket.used_tokens is not None:
+                tpm.refund(ticket.tokens - ticket.used_tokens)
+            if not self._queue:
+                # Idle: forget per-tenant finish tags so the maps cannot grow without bound
+                self._user_finish.clear()
+                self._project_finish.clear()
+            self._cond.notify_all()
+
+
+def estimate_run_tokens(message):
+    # Roughly four characters per token, plus headroom for instructions, history and file search context
+    return len(message) // 4 + get_scheduler_settings()['DEFAULT_TPM_ESTIMATE']
+
+
+def rejected_response(error):
+    response = Response({"error": str(error), "retry_after": error.retry_after}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+
+class AdmissionControlMixin:
+    """Expose the admitted ticket's queue wait as an `X-Queue-Wait-Ms` response header."""
+
+    scheduler_ticket = None
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.scheduler_ticket is not None:
+            response['X-Queue-Wait-Ms'] = str(self.scheduler_ticket.wait_ms)
+        return response
+
+
+run_scheduler = RunScheduler()
@@ -1,12 +1,14 @@
 from rest_framework import serializers
-from .models import Project, UploadedFile, ChatSession, ChatMessage, MODEL_CHOICES
+
+from .batch import get_batch_settings, job_progress
+from .models import Project, UploadedFile, ChatSession, ChatMessage, Citation, DailyUsage, BatchJob, MODEL_CHOICES
 
 class ProjectSerializer(serializers.ModelSerializer):
     model = serializers.ChoiceField(choices=MODEL_CHOICES, required=False)
 
     class Meta:
         model = Project
-        fields = ['id', 'name', 'model', 'openai_vector_store_id', 'openai_assistant_id', 'created_at']
+        fields = ['id', 'name', 'model', 'routing_mode', 'fast_model', 'latency_slo_ms', 'monthly_token_budget', 'budget_exceeded_action', 'openai_vector_store_id', 'openai_assistant_id', 'created_at']
         read_only_fields = ['id', 'openai_vector_store_id', 'openai_assistant_id', 'created_at']
 
 class UploadedFileSerializer(serializers.ModelSerializer):
@@ -19,14 +21,58 @@ class ChatSessionSerializer(serializers.ModelSerializer):
     # Make name writable during creation, but still optional
     name = serializers.CharField(max_length=255, required=False, allow_blank=True)
 
+    # Activity fields come from ChatSession.objects.with_activity(); a freshly created session has none
+    message_count = serializers.IntegerField(read_only=True, default=0)
+    last_message_at = serializers.DateTimeField(read_only=True, default=None)
+    last_message_preview = serializers.CharField(read_only=True, default=None)
+    last_activity_at = serializers.SerializerMethodField()
+
     class Meta:
         model = ChatSession
-        fields = ['id', 'project', 'openai_thread_id', 'created_at', 'name']
+        fields = ['id', 'project', 'openai_thread_id', 'created_at', 'name', 'message_count', 'last_message_at', 'last_message_preview', 'last_activity_at']
         # Keep thread_id read-only as it's generated internally
         read_only_fields = ['id', 'project', 'openai_thread_id', 'created_at']
 
+    def get_last_activity_at(self, obj):
+        # Without the annotation (a session just created) fall back like with_activity() does, so the
+        # create response agrees with the list ordering
+        last_activity_at = getattr(obj, 'last_activity_at', None) or obj.created_at
+        return serializers.DateTimeField().to_representation(last_activity_at)
+
+class CitationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Citation
+        fields = ['number', 'type', 'file_id', 'filename', 'quote', 'start_index', 'end_index']
+
 class ChatMessageSerializer(serializers.ModelSerializer):
+    # Read from a prefetch: list querysets should use prefetch_related('citations')
+    citations = CitationSerializer(many=True, read_only=True)
+
     class Meta:
         model = ChatMessage
-        fields = ['id', 'session', 'role', 'content', 'timestamp']
-        read_only_fields = ['id', 'session', 'timestamp'] # Role and content are provided or generated
+        fields = ['id', 'session', 'role', 'content', 'timestamp', 'tool_call_id', 'tool_name', 'citations']
+        read_only_fields = ['id', 'session', 'timestamp', 'tool_call_id', 'tool_name'] # Role and content are provided or generated
+
+class DailyUsageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailyUsage
+        fields = ['date', 'project', 'user', 'run_count', 'prompt_tokens', 'completion_tokens', 'total_duration_ms']
+        read_only_fields = fields
+
+class BatchJobSerializer(serializers.ModelSerializer):
+    questions = serializers.ListField(
+        child=serializers.CharField(allow_blank=False),
+        write_only=True,
+        min_length=1,
+        max_length=get_batch_settings()['MAX_QUESTIONS'],
+    )
+    concurrency = serializers.IntegerField(min_value=1, max_value=get_batch_settings()['MAX_CONCURRENCY'], required=False)
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = BatchJob
+        fields = ['id', 'project', 'name', 'status', 'concurrency', 'questions', 'progress', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = ['id', 'project', 'status', 'created_at', 'started_at', 'finished_at']
+
+    def get_progress(self, obj):
+        return job_progress(obj)
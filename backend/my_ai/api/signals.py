@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_token, invalidate_user_tokens
+
+User = get_user_model()
+
+
+# --- Token cache invalidation --- #
+@receiver(post_save, sender=User)
+def invalidate_tokens_on_user_change(sender, instance, created, **kwargs):
+    # The cache holds the whole User, so any change (is_active, is_staff, password)
+    # must evict it or requests keep the old state until the TTL expires
+    if not created:
+        invalidate_user_tokens(instance)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_tokens_on_permission_change(sender, instance, action, reverse, pk_set, **kwargs):
+    # Group and permission changes don't save the User, so they need their own eviction
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_user_tokens(instance)
+        return
+    # Changed from the group's or permission's side (e.g. group.user_set.add(user))
+    if action in ('post_add', 'post_remove'):
+        users = User.objects.filter(pk__in=pk_set)
+    elif action == 'pre_clear':
+        users = instance.user_set.all()
+    else:
+        return
+    for user in users:
+        invalidate_user_tokens(user)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_tokens_on_user_delete(sender, instance, **kwargs):
+    invalidate_user_tokens(instance)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
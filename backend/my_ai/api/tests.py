@@ -1,3 +1,899 @@
-from django.test import TestCase
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import fast_serializers, profiling, tools
+from .archive import archive_session, rehydrate_session
+from .authentication import CachedTokenAuthentication, _local_cache, get_cached_token
+from .batch import BatchRunner, effective_concurrency, job_progress
+from .citations import CitationRenderer, save_citations
+from .fast_serializers import FastListSerializer
+from .management.commands import loadtest
+from .models import (
+    ArchivedSession, BatchJob, BatchQuestion, ChatMessage, ChatSession, Citation, DailyUsage, Project, UploadedFile, UsageRecord,
+)
+from .routing import choose_model, model_stats, record_run_outcome
+from .scheduler import BATCH, RUN_SCHEDULER_DEFAULTS, AdmissionRejected, RunScheduler, rejected_response, run_scheduler
+from .serializers import ChatMessageSerializer, UploadedFileSerializer
+from .tools import ToolContext, ToolRegistry, calculate, execute_tool_calls, resolve_required_actions
+from .usage import _bump_daily_usage
+
+# api.views builds its OpenAI client at import time; no request in these tests reaches OpenAI
+os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+
+
+# --- Token authentication cache --- #
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        _local_cache.clear()
+        self.user = get_user_model().objects.create_user('alice', password='secret', is_staff=True)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def test_token_is_cached_after_first_request(self):
+        self.assertIsNone(get_cached_token(self.token.key))
+        self.assertEqual(self.client.get('/api/projects/').status_code, 200)
+        self.assertIsNotNone(get_cached_token(self.token.key))
+
+    def test_revoking_staff_takes_effect_immediately(self):
+        self.assertEqual(self.client.get('/api/profiles/').status_code, 200)
+        self.user.is_staff = False
+        self.user.save()
+        self.assertIsNone(get_cached_token(self.token.key))
+        self.assertEqual(self.client.get('/api/profiles/').status_code, 403)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get('/api/projects/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/projects/').status_code, 401)
+
+    def test_password_change_evicts_cached_user(self):
+        self.client.get('/api/projects/')
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertIsNone(get_cached_token(self.token.key))
+
+    def test_each_request_gets_its_own_user(self):
+        authentication = CachedTokenAuthentication()
+        first, first_token = authentication.authenticate_credentials(self.token.key)
+        first._perm_cache = {'api.delete_project'}
+        second, second_token = authentication.authenticate_credentials(self.token.key)
+        self.assertIsNot(first, second)
+        self.assertFalse(hasattr(second, '_perm_cache'))
+        self.assertIs(second_token.user, second)
+
+    def test_group_and_permission_changes_evict_cached_user(self):
+        group = Group.objects.create(name='editors')
+        permission = Permission.objects.get(codename='delete_project')
+        for change in (
+            lambda: self.user.groups.add(group),
+            lambda: self.user.user_permissions.add(permission),
+            lambda: group.user_set.remove(self.user),
+            lambda: permission.user_set.clear(),
+        ):
+            self.client.get('/api/projects/')
+            self.assertIsNotNone(get_cached_token(self.token.key))
+            change()
+            self.assertIsNone(get_cached_token(self.token.key))
+
+    def test_logout_evicts_token(self):
+        self.client.get('/api/projects/')
+        self.assertEqual(self.client.post('/api/logout/').status_code, 200)
+        self.assertIsNone(get_cached_token(self.token.key))
+        self.assertEqual(self.client.get('/api/projects/').status_code, 401)
+
+
+# --- Fast list serialization --- #
+class FastListSerializerTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='fast')
+        self.session = ChatSession.objects.create(project=self.project, openai_thread_id='thread_fast')
+        contents = [
+            ('user', "Grüße aus Köln — 你好? Line\u2028separator and paragraph\u2029separator 🚀"),
+            ('assistant', "See the handbook [1] and the appendix [2]"),
+            ('tool', '{"arguments": {}, "output": {"ok": 1}}'),
+        ]
+        started = datetime.datetime(2024, 5, 1, 12, 0, tzinfo=datetime.timezone.utc)
+        for index, (role, content) in enumerate(contents):
+            message = ChatMessage.objects.create(
+                session=self.session, role=role, content=content,
+                tool_call_id='call_1' if role == 'tool' else None, tool_name='calculate' if role == 'tool' else None,
+            )
+            ChatMessage.objects.filter(pk=message.pk).update(timestamp=started + datetime.timedelta(seconds=index, microseconds=index))
+        answer = ChatMessage.objects.get(session=self.session, role='assistant')
+        Citation.objects.create(message=answer, number=1, file_id='file_1', filename='Handbuch für Ärzte.pdf', quote='„Zitat“\u2028', start_index=17, end_index=20)
+        Citation.objects.create(message=answer, number=2, file_id='file_2', filename=None, quote='', start_index=38, end_index=41)
+        UploadedFile.objects.create(project=self.project, filename='résumé 履歴書.txt', openai_file_id='file_1')
+        UploadedFile.objects.create(project=self.project, filename='notes.md', openai_file_id='file_2')
+
+    def _assert_identical(self, serializer_class, queryset):
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        self.assertEqual(FastListSerializer(serializer_class).render(queryset), expected)
+        with mock.patch.object(fast_serializers, 'orjson', None):
+            self.assertEqual(FastListSerializer(serializer_class).render(queryset), expected)
+
+    def test_output_matches_drf_byte_for_byte(self):
+        messages = ChatMessage.objects.filter(session=self.session).prefetch_related('citations').order_by('timestamp')
+        self._assert_identical(ChatMessageSerializer, messages)
+        self._assert_identical(UploadedFileSerializer, UploadedFile.objects.filter(project=self.project).order_by('-uploaded_at'))
+
+    def test_long_lists_are_streamed_in_chunks(self):
+        for index in range(6):
+            message = ChatMessage.objects.create(session=self.session, role='user', content=f"Nachricht Nr. {index} — ü")
+            ChatMessage.objects.filter(pk=message.pk).update(timestamp=datetime.datetime(2024, 5, 2, index, tzinfo=datetime.timezone.utc))
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(get_user_model().objects.create_user('gina', password='secret'))
+        with mock.patch.object(fast_serializers, 'STREAM_THRESHOLD', 3), mock.patch.object(fast_serializers, 'CHUNK_SIZE', 2):
+            response = client.get(f'/api/projects/{self.project.id}/sessions/{self.session.id}/messages/')
+            self.assertTrue(response.streaming)
+            body = b''.join(response.streaming_content)
+        messages = ChatMessage.objects.filter(session=self.session).prefetch_related('citations').order_by('timestamp')
+        self.assertEqual(body, JSONRenderer().render(ChatMessageSerializer(messages, many=True).data))
+
+
+# --- Usage accounting --- #
+class DailyUsageTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='usage')
+        self.date = datetime.date(2025, 1, 1)
+
+    def test_runs_without_user_share_one_rollup(self):
+        _bump_daily_usage(self.project, None, self.date, 10, 5, 100)
+        _bump_daily_usage(self.project, None, self.date, 20, 5, 200)
+        rollup = DailyUsage.objects.get(project=self.project, user=None, date=self.date)
+        self.assertEqual((rollup.run_count, rollup.prompt_tokens, rollup.total_duration_ms), (2, 30, 300))
+
+    def test_duplicate_rollup_without_user_is_rejected(self):
+        DailyUsage.objects.create(project=self.project, date=self.date)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DailyUsage.objects.create(project=self.project, date=self.date)
+
+
+# --- Adaptive model routing --- #
+class RunOutcomeTests(TestCase):
+    def test_openai_exception_is_recorded_as_failed_run(self):
+        from . import views
+
+        model_stats.reset()
+        user = get_user_model().objects.create_user('bob', password='secret')
+        project = Project.objects.create(name='routing', openai_assistant_id='asst_1')
+        session = ChatSession.objects.create(project=project, openai_thread_id='thread_routing')
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(user)
+
+        openai_client = mock.MagicMock()
+        openai_client.beta.assistants.retrieve.return_value = mock.MagicMock(id='asst_1', model=project.model, tools=[])
+        openai_client.beta.threads.runs.create_and_poll.side_effect = TimeoutError("Request timed out.")
+        with mock.patch.object(views, 'client', openai_client):
+            response = client.post(f'/api/projects/{project.id}/sessions/{session.id}/chat/', {'message': 'hi'}, format='json')
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual([ok for _, ok in model_stats.snapshot(project.model)], [False])
+
+
+class ChooseModelTests(TestCase):
+    LONG_MESSAGE = 'Tell me what the team is planning for the next quarter. ' * 10
+
+    def setUp(self):
+        model_stats.reset()
+        self.addCleanup(model_stats.reset)
+        self.project = Project.objects.create(
+            name='adaptive', model='gpt-4', fast_model='gpt-3.5-turbo', routing_mode='adaptive',
+            latency_slo_ms=2000, openai_vector_store_id='vs_1',
+        )
+
+    def seed(self, model, durations, failures=0):
+        for duration in durations:
+            record_run_outcome(model, duration, True)
+        for _ in range(failures):
+            record_run_outcome(model, 100, False)
+
+    def test_trivial_messages_go_to_the_fast_model(self):
+        self.assertEqual(choose_model(self.project, 'Thanks, that helps!'), ('gpt-3.5-turbo', 'trivial message'))
+
+    def test_file_search_and_complex_messages_keep_the_primary(self):
+        self.seed('gpt-4', [500] * 10)
+        for message in ['What does the policy say about leave?', 'Explain this in one line', 'Fix ```x = 1```']:
+            self.assertEqual(choose_model(self.project, message), ('gpt-4', 'primary model within SLO'), message)
+        # Without a vector store there is nothing to search, so a file hint alone is trivial
+        self.project.openai_vector_store_id = None
+        self.assertEqual(choose_model(self.project, 'What does the policy say?')[0], 'gpt-3.5-turbo')
+
+    def test_primary_without_enough_samples_is_kept(self):
+        self.seed('gpt-4', [9000] * 3)
+        self.assertEqual(choose_model(self.project, self.LONG_MESSAGE), ('gpt-4', 'primary model (insufficient latency data)'))
+
+    @mock.patch('api.routing.random.random', return_value=0.99)
+    def test_falls_back_when_primary_p90_is_over_the_slo(self, _random):
+        self.seed('gpt-4', [500] * 8 + [5000] * 2)
+        self.assertEqual(choose_model(self.project, self.LONG_MESSAGE), ('gpt-3.5-turbo', 'primary model missed latency SLO'))
+
+    @mock.patch('api.routing.random.random', return_value=0.99)
+    def test_falls_back_when_primary_error_rate_is_over_the_limit(self, _random):
+        self.seed('gpt-4', [500] * 7, failures=3)
+        self.assertEqual(choose_model(self.project, self.LONG_MESSAGE)[0], 'gpt-3.5-turbo')
+
+    @mock.patch('api.routing.random.random', return_value=0.99)
+    def test_primary_within_slo_is_kept(self, _random):
+        self.seed('gpt-4', [500] * 9 + [5000], failures=2)
+        self.assertEqual(choose_model(self.project, self.LONG_MESSAGE), ('gpt-4', 'primary model within SLO'))
+
+    def test_degraded_primary_is_probed(self):
+        self.seed('gpt-4', [5000] * 10)
+        with mock.patch('api.routing.random.random', return_value=0.05):
+            self.assertEqual(choose_model(self.project, self.LONG_MESSAGE), ('gpt-4', 'probing degraded primary model'))
+        with mock.patch('api.routing.random.random', return_value=0.1):
+            self.assertEqual(choose_model(self.project, self.LONG_MESSAGE)[0], 'gpt-3.5-turbo')
+
+    @mock.patch('api.routing.random.random', return_value=0.99)
+    def test_unhealthy_fallback_keeps_the_primary(self, _random):
+        self.seed('gpt-4', [5000] * 10)
+        self.seed('gpt-3.5-turbo', [300] * 5, failures=5)
+        self.assertEqual(
+            choose_model(self.project, self.LONG_MESSAGE), ('gpt-4', 'primary model degraded but fallback is unhealthy'),
+        )
+
+    def test_fixed_mode_always_uses_the_project_model(self):
+        self.seed('gpt-4', [9000] * 10)
+        self.project.routing_mode = 'fixed'
+        for message in ['hi', self.LONG_MESSAGE]:
+            self.assertEqual(choose_model(self.project, message), ('gpt-4', 'fixed'))
+        self.project.routing_mode = 'adaptive'
+        self.project.fast_model = 'gpt-4'
+        self.assertEqual(choose_model(self.project, 'hi'), ('gpt-4', 'fixed'))
+
+
+# --- Admission control --- #
+def make_scheduler(**overrides):
+    return RunScheduler(config={**RUN_SCHEDULER_DEFAULTS, 'RATE_LIMITS': {'default': {'rpm': None, 'tpm': None}}, **overrides})
+
+
+class RunSchedulerTests(TestCase):
+    def _acquire_in_thread(self, scheduler, user, project, order, tokens=0, lane='interactive'):
+        def run():
+            ticket = scheduler.acquire(user, project, 'gpt-4o', tokens, lane=lane)
+            order.append(user)
+            scheduler.release(ticket)
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def _wait_for_queue(self, scheduler, depth):
+        deadline = time.monotonic() + 5
+        while len(scheduler._queue) < depth:
+            self.assertLess(time.monotonic(), deadline, "tickets never queued")
+            time.sleep(0.01)
+
+    def test_light_tenant_is_not_queued_behind_heavy_backlog(self):
+        scheduler = make_scheduler(MAX_CONCURRENT=1, MAX_ACTIVE_PER_TENANT=10, MAX_QUEUED_PER_TENANT=10)
+        holder = scheduler.acquire('holder', 'p0', 'gpt-4o')
+        order = []
+        threads = [self._acquire_in_thread(scheduler, 'heavy', 'p1', order) for _ in range(3)]
+        self._wait_for_queue(scheduler, 3)
+        threads.append(self._acquire_in_thread(scheduler, 'light', 'p2', order))
+        self._wait_for_queue(scheduler, 4)
+        scheduler.release(holder)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(sorted(order), ['heavy', 'heavy', 'heavy', 'light'])
+        self.assertIn('light', order[:2])
+
+    def test_per_tenant_caps(self):
+        scheduler = make_scheduler(MAX_CONCURRENT=4, MAX_ACTIVE_PER_TENANT=1, MAX_QUEUED_PER_TENANT=1, QUEUE_TIMEOUT=5)
+        first = scheduler.acquire('u1', 'p1', 'gpt-4o')
+        order = []
+        waiting = self._acquire_in_thread(scheduler, 'u1', 'p1', order)
+        self._wait_for_queue(scheduler, 1)
+
+        # Over the queued cap: rejected at once rather than waiting
+        with self.assertRaises(AdmissionRejected):
+            scheduler.acquire('u1', 'p1', 'gpt-4o')
+        # Another tenant is admitted even though u1 is waiting for a slot
+        other = scheduler.acquire('u2', 'p2', 'gpt-4o')
+        self.assertEqual(order, [])
+
+        scheduler.release(first)
+        waiting.join(5)
+        self.assertEqual(order, ['u1'])
+        scheduler.release(other)
+
+    def test_rejection_carries_retry_after(self):
+        scheduler = make_scheduler(MAX_CONCURRENT=1, QUEUE_TIMEOUT=0.05)
+        holder = scheduler.acquire('u1', 'p1', 'gpt-4o')
+        with self.assertRaises(AdmissionRejected) as caught:
+            scheduler.acquire('u2', 'p2', 'gpt-4o')
+        self.assertGreaterEqual(caught.exception.retry_after, 1)
+        self.assertEqual(scheduler._queue, [])
+        scheduler.release(holder)
+
+        response = rejected_response(caught.exception)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(caught.exception.retry_after))
+
+    def test_token_bucket_is_settled_against_actual_usage(self):
+        scheduler = make_scheduler(RATE_LIMITS={'default': {'rpm': None, 'tpm': 6000}})
+        ticket = scheduler.acquire('u1', 'p1', 'gpt-4o', tokens=5000)
+        _, tpm = scheduler._buckets_for('gpt-4o')
+        self.assertAlmostEqual(tpm.tokens, 1000, delta=50)
+
+        # Unused reservation is refunded once the run's real usage is known
+        ticket.used_tokens = 1000
+        scheduler.release(ticket)
+        self.assertAlmostEqual(tpm.tokens, 5000, delta=50)
+
+        # Usage beyond the estimate is carried as debt
+        ticket = scheduler.acquire('u1', 'p1', 'gpt-4o', tokens=1000)
+        ticket.used_tokens = 5000
+        scheduler.release(ticket)
+        self.assertAlmostEqual(tpm.tokens, 0, delta=50)
+
+    def test_batch_lane_leaves_interactive_share_free(self):
+        scheduler = make_scheduler(
+            MAX_CONCURRENT=4, MAX_ACTIVE_PER_TENANT=2, MAX_QUEUED_PER_TENANT=1, QUEUE_TIMEOUT=5,
+            BATCH_MAX_CONCURRENT=2, BATCH_MAX_ACTIVE_PER_TENANT=2,
+        )
+        batch = [scheduler.acquire('u1', 'p1', 'gpt-4o', lane=BATCH) for _ in range(2)]
+        order = []
+        backlog = [self._acquire_in_thread(scheduler, 'u1', 'p1', order, lane=BATCH) for _ in range(3)]
+        self._wait_for_queue(scheduler, 3)
+
+        # The same user and project still get their full interactive share, without queueing
+        interactive = [scheduler.acquire('u1', 'p1', 'gpt-4o') for _ in range(2)]
+        self.assertTrue(all(ticket.wait_ms < 100 for ticket in interactive))
+        self.assertEqual(order, [])
+
+        for ticket in batch + interactive:
+            scheduler.release(ticket)
+        for thread in backlog:
+            thread.join(5)
+        self.assertEqual(len(order), 3)
+
+    def test_batch_lane_has_its_own_slots(self):
+        scheduler = make_scheduler(MAX_CONCURRENT=1, BATCH_MAX_CONCURRENT=2, BATCH_MAX_ACTIVE_PER_TENANT=2, QUEUE_TIMEOUT=0.05)
+        chat = scheduler.acquire('chat', 'p1', 'gpt-4o')
+        batch = [scheduler.acquire('batch', 'p1', 'gpt-4o', lane=BATCH) for _ in range(2)]
+        self.assertTrue(all(ticket.wait_ms < 100 for ticket in batch))
+        with self.assertRaises(AdmissionRejected):
+            scheduler.acquire('batch', 'p1', 'gpt-4o', lane=BATCH)
+
+        # A full batch lane does not hold back interactive requests
+        scheduler.release(chat)
+        self.assertLess(scheduler.acquire('chat', 'p1', 'gpt-4o').wait_ms, 100)
+
+    def test_interactive_goes_before_waiting_batch(self):
+        scheduler = make_scheduler(RATE_LIMITS={'default': {'rpm': 600, 'tpm': None}})
+        rpm, _ = scheduler._buckets_for('gpt-4o')
+        rpm.tokens = -2  # Both lanes wait for the same rate budget; it refills one request per 0.1 s
+        order = []
+        threads = [self._acquire_in_thread(scheduler, 'batch', 'p1', order, lane=BATCH)]
+        self._wait_for_queue(scheduler, 1)
+        threads.append(self._acquire_in_thread(scheduler, 'chat', 'p1', order))
+        self._wait_for_queue(scheduler, 2)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(order, ['chat', 'batch'])
+
+
+# --- Batch jobs --- #
+@override_settings(BATCH_JOBS={'MAX_CONCURRENCY': 1})
+class BatchJobResultsTests(TransactionTestCase):
+    # Batch questions are answered on worker threads, which need committed data. One worker at a
+    # time: the in-memory SQLite test database raises on concurrent writes to a table instead of waiting
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('carol', password='secret')
+        self.project = Project.objects.create(name='batch', openai_assistant_id='asst_1')
+        self.job = BatchJob.objects.create(project=self.project, user=self.user)
+        BatchQuestion.objects.bulk_create(
+            BatchQuestion(job=self.job, index=index, question=f"Question {index}") for index in range(2)
+        )
+        self.url = f'/api/projects/{self.project.id}/batches/{self.job.id}/results/'
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.user)
+
+    def _lines(self, response):
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_get_is_read_only(self):
+        from . import views
+
+        with mock.patch.object(views, 'client') as openai_client:
+            lines = self._lines(self.client.get(self.url))
+        openai_client.beta.threads.create_and_run_poll.assert_not_called()
+        self.assertEqual(lines, [{"type": "summary", "job_id": self.job.id, "status": "pending", **job_progress(self.job)}])
+        self.assertEqual(self.job.questions.filter(status='pending').count(), 2)
+
+    def test_post_runs_the_job(self):
+        from . import views
+
+        openai_client = mock.MagicMock()
+        openai_client.beta.assistants.retrieve.return_value = mock.MagicMock(id='asst_1', model=self.project.model, tools=[])
+        openai_client.beta.threads.create_and_run_poll.return_value = mock.MagicMock(status='completed', usage=None, thread_id='thread_batch')
+        with mock.patch.object(views, 'client', openai_client):
+            lines = self._lines(self.client.post(self.url))
+        self.assertEqual(openai_client.beta.threads.create_and_run_poll.call_count, 2)
+        self.assertEqual([line['status'] for line in lines[:-1]], ['done', 'done'])
+        self.assertEqual(lines[-1]['status'], 'completed')
+
+    def test_questions_fail_once_the_batch_spends_the_budget(self):
+        from . import views
+
+        Project.objects.filter(pk=self.project.pk).update(monthly_token_budget=100, budget_exceeded_action='reject')
+        BatchQuestion.objects.create(job=self.job, index=2, question="Question 2")
+        openai_client = mock.MagicMock()
+        openai_client.beta.assistants.retrieve.return_value = mock.MagicMock(id='asst_1', model=self.project.model, tools=[])
+        openai_client.beta.threads.create_and_run_poll.return_value = mock.MagicMock(
+            status='completed', thread_id='thread_batch', usage=mock.MagicMock(prompt_tokens=60, completion_tokens=40),
+        )
+        with mock.patch.object(views, 'client', openai_client):
+            lines = self._lines(self.client.post(self.url))
+        self.assertEqual(openai_client.beta.threads.create_and_run_poll.call_count, 1)
+        self.assertEqual([line['status'] for line in lines[:-1]], ['done', 'failed', 'failed'])
+        self.assertTrue(all(line['error'].startswith("Monthly token budget exhausted") for line in lines[1:-1]))
+
+    def test_workers_are_clamped_to_the_scheduler_caps(self):
+        self.job.concurrency = 8
+        with self.settings(BATCH_JOBS={'MAX_CONCURRENCY': 16}):
+            with mock.patch.dict(run_scheduler.config, BATCH_MAX_ACTIVE_PER_TENANT=3):
+                self.assertEqual(job_progress(self.job)['concurrency'], 3)
+            with mock.patch.dict(run_scheduler.config, ENABLED=False, BATCH_MAX_ACTIVE_PER_TENANT=3):
+                self.assertEqual(effective_concurrency(self.job), 8)
+        with self.settings(BATCH_JOBS={'MAX_CONCURRENCY': 2}):
+            self.assertEqual(effective_concurrency(self.job), 2)
+
+    def test_heartbeat_continues_while_a_question_is_in_flight(self):
+        from . import views
+
+        openai_client = mock.MagicMock()
+        openai_client.beta.assistants.retrieve.return_value = mock.MagicMock(id='asst_1', model=self.project.model, tools=[])
+
+        def slow_run(**kwargs):
+            time.sleep(0.5)
+            return mock.MagicMock(status='completed', usage=None, thread_id='thread_batch')
+        openai_client.beta.threads.create_and_run_poll.side_effect = slow_run
+
+        with self.settings(BATCH_JOBS={'MAX_CONCURRENCY': 1, 'HEARTBEAT_INTERVAL': 0.1}), mock.patch.object(views, 'client', openai_client):
+            runner = BatchRunner(self.job, openai_client, views.get_or_create_assistant, views.build_assistant_reply)
+            runner.start()
+            claimed_at = BatchJob.objects.get(pk=self.job.pk).heartbeat_at
+            results = runner.results()
+            next(results)  # Blocks until the first (slow) question finishes
+            self.assertGreater(BatchJob.objects.get(pk=self.job.pk).heartbeat_at, claimed_at)
+            list(results)
+
+    def test_question_fails_when_not_admitted_before_the_deadline(self):
+        from . import batch, views
+
+        openai_client = mock.MagicMock()
+        openai_client.beta.assistants.retrieve.return_value = mock.MagicMock(id='asst_1', model=self.project.model, tools=[])
+        rejected = AdmissionRejected("Too many queued requests", retry_after=0.01)
+        with self.settings(BATCH_JOBS={'MAX_CONCURRENCY': 1, 'ADMISSION_TIMEOUT': 0.05}), \
+                mock.patch.object(batch.run_scheduler, 'acquire', side_effect=rejected), \
+                mock.patch.object(batch.run_scheduler, 'release') as release, \
+                mock.patch.object(views, 'client', openai_client):
+            lines = self._lines(self.client.post(self.url))
+        openai_client.beta.threads.create_and_run_poll.assert_not_called()
+        release.assert_not_called()
+        self.assertEqual([line['status'] for line in lines[:-1]], ['failed', 'failed'])
+        self.assertIn("within 0.05s", lines[0]['error'])
+        self.assertEqual(self.job.questions.filter(status='failed').count(), 2)
+
+
+# --- Chat session list --- #
+class ChatSessionListTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='sessions')
+        self.url = f'/api/projects/{self.project.id}/sessions/'
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(get_user_model().objects.create_user('frank', password='secret'))
+
+    def _session(self, name, active_at=None):
+        session = ChatSession.objects.create(project=self.project, openai_thread_id=f'thread_{name}', name=name)
+        if active_at is not None:
+            ChatMessage.objects.create(session=session, role='user', content=f"Hello from {name}")
+            ChatMessage.objects.filter(session=session).update(timestamp=active_at)
+        return session
+
+    def test_created_session_reports_its_creation_as_last_activity(self):
+        from . import views
+
+        with mock.patch.object(views, 'client') as openai_client:
+            openai_client.beta.threads.create.return_value = SimpleNamespace(id='thread_new')
+            created = self.client.post(self.url, {"name": "New"}, format='json').json()
+        self.assertIsNotNone(created['last_activity_at'])
+        self.assertEqual(created['last_activity_at'], created['created_at'])
+        self.assertEqual(self.client.get(self.url).json()[0]['last_activity_at'], created['last_activity_at'])
+
+    def test_list_is_one_query_ordered_by_recent_activity(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self._session('old', active_at=now - datetime.timedelta(days=3))
+        self._session('recent', active_at=now - datetime.timedelta(hours=1))
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.client.get(self.url).json()), 2)
+
+        self._session('quiet')  # No messages: ordered by its creation, which is the most recent activity
+        for day in range(5):
+            self._session(f'day-{day}', active_at=now - datetime.timedelta(days=10 + day))
+        with self.assertNumQueries(1):
+            sessions = self.client.get(self.url).json()
+        self.assertEqual([session['name'] for session in sessions][:3], ['quiet', 'recent', 'old'])
+        self.assertEqual([session['name'] for session in sessions][3:], [f'day-{day}' for day in range(5)])
+        self.assertEqual(sessions[1]['message_count'], 1)
+        self.assertEqual(sessions[1]['last_message_preview'], "Hello from recent")
+
+
+# --- Function tools --- #
+class CalculateToolTests(TestCase):
+    def test_arithmetic(self):
+        self.assertEqual(calculate({"expression": "(1200 * 0.15) + 30"}, None), {"result": 210.0})
+        self.assertEqual(calculate({"expression": "2 ** 64 // 3 % 7"}, None), {"result": 2 ** 64 // 3 % 7})
+
+    def test_nested_powers_are_refused_before_they_are_computed(self):
+        started = time.monotonic()
+        self.assertEqual(calculate({"expression": "((((9**99)**99)**99)**99)"}, None), {"error": "Result too large."})
+        self.assertEqual(calculate({"expression": "(2**5000) * (2**5001)"}, None), {"error": "Result too large."})
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_only_arithmetic_is_allowed(self):
+        self.assertIn("error", calculate({"expression": "__import__('os')"}, None))
+
+
+class ToolRunLoopTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='tools')
+        self.session = ChatSession.objects.create(project=self.project, openai_thread_id='thread_tools')
+        self.registry = ToolRegistry()
+        self.enterContext(mock.patch.object(tools, 'registry', self.registry))
+        self.calls = Counter()
+
+        @self.registry.register('echo', "Echo the arguments.", {"type": "object"})
+        def echo(arguments, context):
+            self.calls['echo'] += 1
+            return {"echo": arguments}
+
+        self.client = mock.MagicMock()
+        self.client.beta.threads.runs.submit_tool_outputs_and_poll.return_value = SimpleNamespace(status='completed')
+
+    def _tool_call(self, call_id, name, arguments):
+        return SimpleNamespace(id=call_id, function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+
+    def _run(self, *tool_calls):
+        return SimpleNamespace(
+            id='run_1', thread_id='thread_tools', status='requires_action',
+            required_action=SimpleNamespace(type='submit_tool_outputs', submit_tool_outputs=SimpleNamespace(tool_calls=list(tool_calls))),
+        )
+
+    def _register_sleep(self, timeout=None):
+        @self.registry.register('sleep', "Sleep for a while.", {"type": "object"}, timeout=timeout)
+        def sleep(arguments, context):
+            time.sleep(arguments['seconds'])
+            return {"slept": arguments['seconds']}
+
+    def test_step_takes_as_long_as_its_slowest_tool(self):
+        self._register_sleep()
+        tool_calls = [self._tool_call(f'call_{i}', 'sleep', {"seconds": 0.3}) for i in range(3)]
+        started = time.monotonic()
+        results = execute_tool_calls(tool_calls, ToolContext(self.project))
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual([json.loads(output) for _, _, output in results], [{"slept": 0.3}] * 3)
+
+    def test_timed_out_tool_answers_with_an_error(self):
+        self._register_sleep(timeout=0.1)
+        results = execute_tool_calls(
+            [self._tool_call('call_1', 'sleep', {"seconds": 0.5}), self._tool_call('call_2', 'echo', {})], ToolContext(self.project),
+        )
+        self.assertEqual(json.loads(results[0][2]), {"error": "Tool timed out after 0.1 seconds."})
+        self.assertEqual(json.loads(results[1][2]), {"echo": {}})
+
+    def test_cached_tools_are_served_from_cache_per_project(self):
+        @self.registry.register('files', "List files.", {"type": "object"}, cache_ttl=60, per_project=True)
+        def files(arguments, context):
+            self.calls[context.project.id] += 1
+            return {"project": context.project.id}
+
+        @self.registry.register('constant', "A constant.", {"type": "object"}, cache_ttl=60)
+        def constant(arguments, context):
+            self.calls['constant'] += 1
+            return {"value": 42}
+
+        other = ToolContext(Project.objects.create(name='other'))
+        context = ToolContext(self.project)
+        for tool_context in (context, context, other, other):
+            self.registry.call('files', {}, tool_context)
+            self.registry.call('constant', {}, tool_context)
+        self.assertEqual(self.registry.call('files', {}, other), json.dumps({"project": other.project.id}))
+        self.assertEqual(self.calls, Counter({self.project.id: 1, other.project.id: 1, 'constant': 1}))
+
+        self.registry.call('echo', {}, context)
+        self.registry.call('echo', {}, context)
+        self.assertEqual(self.calls['echo'], 2)
+
+    def test_each_step_submits_all_outputs_at_once(self):
+        runs = self.client.beta.threads.runs
+        runs.submit_tool_outputs_and_poll.side_effect = [
+            self._run(self._tool_call('call_3', 'echo', {"step": 2})),
+            SimpleNamespace(status='completed'),
+        ]
+        first_step = self._run(self._tool_call('call_1', 'echo', {"n": 1}), self._tool_call('call_2', 'echo', {"n": 2}))
+        run = resolve_required_actions(self.client, first_step, ToolContext(self.project))
+        self.assertEqual(run.status, 'completed')
+        self.assertEqual(runs.submit_tool_outputs_and_poll.call_count, 2)
+        first_outputs = runs.submit_tool_outputs_and_poll.call_args_list[0].kwargs['tool_outputs']
+        self.assertEqual([output['tool_call_id'] for output in first_outputs], ['call_1', 'call_2'])
+
+    def test_run_is_cancelled_after_max_steps(self):
+        runs = self.client.beta.threads.runs
+        runs.submit_tool_outputs_and_poll.side_effect = lambda **kwargs: self._run(self._tool_call('call_n', 'echo', {}))
+        runs.cancel.return_value = SimpleNamespace(status='cancelling')
+        with self.settings(ASSISTANT_TOOLS={'MAX_STEPS': 2}):
+            run = resolve_required_actions(self.client, self._run(self._tool_call('call_1', 'echo', {})), ToolContext(self.project))
+        self.assertEqual(run.status, 'cancelling')
+        self.assertEqual(runs.submit_tool_outputs_and_poll.call_count, 2)
+        runs.cancel.assert_called_once_with(thread_id='thread_tools', run_id='run_1')
+
+    def test_tool_messages_are_persisted_with_decoded_output(self):
+        context = ToolContext(self.project, session=self.session)
+        resolve_required_actions(self.client, self._run(self._tool_call('call_1', 'echo', {"x": 1})), context)
+        message = ChatMessage.objects.get(session=self.session, role='tool')
+        self.assertEqual((message.tool_call_id, message.tool_name), ('call_1', 'echo'))
+        self.assertEqual(json.loads(message.content), {"arguments": {"x": 1}, "output": {"echo": {"x": 1}}})
+
+
+# --- Request profiling --- #
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.config = {'ENABLED': True, 'SAMPLE_RATE': 0, 'HEADER_TOKEN': 'let-me-profile', 'DIRECTORY': self.directory}
+        self.enterContext(self.settings(REQUEST_PROFILING=self.config))
+        # Stand in for the sampling thread: every tracked request yields one sample
+        self.track = self.enterContext(mock.patch.object(profiling.sampler, 'track'))
+        self.untrack = self.enterContext(mock.patch.object(profiling.sampler, 'untrack', return_value=Counter({'view': 1})))
+        self.staff = get_user_model().objects.create_user('dave', password='secret', is_staff=True)
+        self.client = APIClient(SERVER_NAME='localhost')
+
+    def _profiles(self):
+        return list(profiling.get_profile_store().iter_profiles())
+
+    def test_header_without_staff_credentials_is_not_even_tracked(self):
+        member = get_user_model().objects.create_user('erin', password='secret')
+        with self.settings(REQUEST_PROFILING={**self.config, 'HEADER_TOKEN': None}):
+            self.client.get('/api/projects/', HTTP_X_PROFILE_REQUEST='1')
+        self.client.get('/api/projects/', HTTP_X_PROFILE_REQUEST='wrong-token')
+        self.client.get('/api/projects/', HTTP_X_PROFILE_REQUEST='1', HTTP_AUTHORIZATION="Token not-a-token")
+        self.client.get('/api/projects/', HTTP_X_PROFILE_REQUEST='1', HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=member).key}")
+        self.track.assert_not_called()
+        self.assertEqual(self._profiles(), [])
+
+    def test_header_with_token_is_honoured(self):
+        self.client.get('/api/projects/', HTTP_X_PROFILE_REQUEST='let-me-profile')
+        self.assertEqual([profile['reason'] for profile in self._profiles()], ['header'])
+
+    def test_header_from_staff_user_is_honoured(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=self.staff).key}")
+        self.client.get('/api/profiles/', HTTP_X_PROFILE_REQUEST='1')
+        self.assertEqual([profile['reason'] for profile in self._profiles()], ['header'])
+
+    def test_streamed_response_is_profiled_until_the_stream_closes(self):
+        project = Project.objects.create(name='profiled')
+        job = BatchJob.objects.create(project=project, user=self.staff)
+        self.client.force_authenticate(self.staff)
+        response = self.client.get(f'/api/projects/{project.id}/batches/{job.id}/results/', HTTP_X_PROFILE_REQUEST='let-me-profile')
+        self.untrack.assert_not_called()
+        b''.join(response.streaming_content)
+        response.close()
+        self.untrack.assert_called_once()
+        self.assertEqual([profile['status'] for profile in self._profiles()], [200])
+
+
+# --- Citations --- #
+def annotation(quote, start, end, file_id, kind='file_citation'):
+    return SimpleNamespace(**{
+        'text': quote, 'start_index': start, 'end_index': end,
+        'file_citation': SimpleNamespace(file_id=file_id) if kind == 'file_citation' else None,
+        'file_path': SimpleNamespace(file_id=file_id) if kind == 'file_path' else None,
+    })
+
+
+def assistant_message(text, annotations=(), role='assistant'):
+    block = SimpleNamespace(type='text', text=SimpleNamespace(value=text, annotations=list(annotations)))
+    return SimpleNamespace(role=role, content=[block])
+
+
+class CitationRendererTests(TestCase):
+    def setUp(self):
+        self.lookups = []
+
+        def retrieve_file(file_id):
+            self.lookups.append(file_id)
+            if file_id == 'file_gone':
+                raise RuntimeError('No such file')
+            return SimpleNamespace(filename=f'{file_id}.pdf')
+
+        self.renderer = CitationRenderer(retrieve_file)
+
+    def assertMarkersPlaced(self, text, citations):
+        for citation in citations:
+            self.assertEqual(text[citation['start_index']:citation['end_index']], f"[{citation['number']}]")
+
+    def test_duplicate_quotes_map_to_their_own_spans(self):
+        quote = '【4:0†source】'
+        text = f'First{quote} and second{quote}.'
+        second = text.rindex(quote)
+        message = assistant_message(text, [
+            annotation(quote, second, second + len(quote), 'file_b'),
+            annotation(quote, 5, 5 + len(quote), 'file_a'),
+        ])
+        rendered, citations = self.renderer.render([message])
+        self.assertEqual(rendered, 'First [1] and second [2].')
+        self.assertEqual([c['file_id'] for c in citations], ['file_a', 'file_b'])
+        self.assertMarkersPlaced(rendered, citations)
+
+    def test_stale_or_missing_offsets_fall_back_to_text_search(self):
+        text = 'Alpha【1】 beta【2】 gamma【3】'
+        message = assistant_message(text, [
+            annotation('【1】', 5, 8, 'file_a'),
+            annotation('【2】', 0, 3, 'file_b'),  # Stale: points at "Alp"
+            annotation('【3】', None, None, 'file_c', kind='file_path'),
+        ])
+        rendered, citations = self.renderer.render([message])
+        self.assertEqual(rendered, 'Alpha [1] beta [2] gamma [3]')
+        self.assertEqual([(c['type'], c['file_id']) for c in citations], [
+            ('file_citation', 'file_a'), ('file_citation', 'file_b'), ('file_path', 'file_c'),
+        ])
+        self.assertMarkersPlaced(rendered, citations)
+
+    def test_unplaceable_annotation_is_skipped(self):
+        message = assistant_message('Nothing cited here', [annotation('【9】', None, None, 'file_a')])
+        self.assertEqual(self.renderer.render([message]), ('Nothing cited here', []))
+
+    def test_failed_file_lookup_keeps_its_number(self):
+        text = 'One【a】 two【b】 three【c】'
+        message = assistant_message(text, [
+            annotation('【a】', 3, 6, 'file_a'),
+            annotation('【b】', 10, 13, 'file_gone'),
+            annotation('【c】', 19, 22, 'file_a'),
+        ])
+        rendered, citations = self.renderer.render([message])
+        self.assertEqual(rendered, 'One [1] two [2] three [3]')
+        self.assertEqual([(c['number'], c['filename']) for c in citations], [
+            (1, 'file_a.pdf'), (2, None), (3, 'file_a.pdf'),
+        ])
+        self.assertEqual(self.lookups, ['file_a', 'file_gone'])
+
+    def test_assistant_messages_are_joined(self):
+        messages = [
+            assistant_message('Hello【x】', [annotation('【x】', 5, 8, 'file_a')]),
+            assistant_message('ignored', role='user'),
+            assistant_message('Again【y】 — done', [annotation('【y】', 5, 8, 'file_b')]),
+        ]
+        rendered, citations = self.renderer.render(messages)
+        self.assertEqual(rendered, 'Hello [1]\nAgain [2] — done')
+        self.assertMarkersPlaced(rendered, citations)
+
+    def test_saved_citations_are_listed_with_a_fixed_query_count(self):
+        project = Project.objects.create(name='cited')
+        session = ChatSession.objects.create(project=project, openai_thread_id='thread_cited')
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(get_user_model().objects.create_user('hana', password='secret'))
+        url = f'/api/projects/{project.id}/sessions/{session.id}/messages/'
+
+        def add_answer():
+            text = 'Answer【a】 and【b】'
+            rendered, citations = CitationRenderer(lambda file_id: SimpleNamespace(filename=f'{file_id}.pdf')).render([
+                assistant_message(text, [annotation('【a】', 6, 9, 'file_a'), annotation('【b】', 13, 16, 'file_b')]),
+            ])
+            message = ChatMessage.objects.create(session=session, role='assistant', content=rendered)
+            save_citations(message, citations)
+            return message
+
+        message = add_answer()
+        with CaptureQueriesContext(connection) as one_message:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        listed = response.json()[0]
+        self.assertEqual(listed['content'], 'Answer [1] and [2]')
+        self.assertEqual(
+            [(c['number'], c['filename'], listed['content'][c['start_index']:c['end_index']]) for c in listed['citations']],
+            [(1, 'file_a.pdf', '[1]'), (2, 'file_b.pdf', '[2]')],
+        )
+        self.assertEqual(message.citations.count(), 2)
+
+        for _ in range(4):
+            add_answer()
+        with self.assertNumQueries(len(one_message)):
+            response = client.get(url)
+        self.assertEqual(len(response.json()), 5)
+
+
+# --- Chat archive --- #
+class ArchiveRoundTripTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='archive')
+        self.session = ChatSession.objects.create(project=self.project, openai_thread_id='thread_archive')
+        self.question = ChatMessage.objects.create(session=self.session, role='user', content="Where is the spec?")
+        self.answer = ChatMessage.objects.create(session=self.session, role='assistant', content="In the handbook [1]")
+        Citation.objects.create(
+            message=self.answer, number=1, file_id='file_1', filename='handbook.pdf', quote='spec', start_index=16, end_index=19,
+        )
+        # Tool-call records are stored after the run; they must not count or show up as the preview
+        self.tool_call = ChatMessage.objects.create(
+            session=self.session, role='tool', content='{"arguments": {}, "output": "ok"}', tool_call_id='call_1', tool_name='lookup',
+        )
+        self.usage = UsageRecord.objects.create(
+            project=self.project, session=self.session, message=self.answer, model='gpt-4o', prompt_tokens=10, completion_tokens=5,
+        )
+        self.idle_since = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        ChatMessage.objects.filter(session=self.session).update(timestamp=self.idle_since)
+
+    def test_activity_ignores_tool_call_records(self):
+        session = ChatSession.objects.with_activity().get(pk=self.session.pk)
+        self.assertEqual(session.message_count, 2)
+        self.assertEqual(session.last_message_preview, "In the handbook [1]")
+
+        archive = archive_session(self.session)
+        self.assertEqual((archive.message_count, archive.last_message_preview), (2, "In the handbook [1]"))
+        session = ChatSession.objects.with_activity().get(pk=self.session.pk)
+        self.assertEqual((session.message_count, session.last_message_preview), (2, "In the handbook [1]"))
+
+    def test_archive_and_rehydrate_restores_messages_citations_and_usage_links(self):
+        archive = archive_session(self.session)
+        self.assertIsNotNone(archive)
+        self.assertFalse(ChatMessage.objects.filter(session=self.session).exists())
+        self.usage.refresh_from_db()
+        self.assertIsNone(self.usage.message_id)
+        self.assertEqual(self.usage.archived_message_id, self.answer.id)
+        self.assertEqual(ChatSession.objects.with_activity().get(pk=self.session.pk).message_count, 2)
+
+        self.assertEqual(rehydrate_session(self.session), 3)
+        self.assertFalse(ArchivedSession.objects.filter(session=self.session).exists())
+        restored = list(ChatMessage.objects.filter(session=self.session).order_by('id'))
+        self.assertEqual([message.id for message in restored], [self.question.id, self.answer.id, self.tool_call.id])
+        self.assertEqual({message.timestamp for message in restored}, {self.idle_since})
+        self.assertEqual((restored[2].tool_call_id, restored[2].tool_name), ('call_1', 'lookup'))
+        self.assertEqual(list(restored[1].citations.values_list('filename', flat=True)), ['handbook.pdf'])
+        self.usage.refresh_from_db()
+        self.assertEqual(self.usage.message_id, self.answer.id)
+        self.assertIsNone(self.usage.archived_message_id)
+
+
+# --- Load test command --- #
+class LoadtestCredentialsTests(TestCase):
+    def setUp(self):
+        self.existing = get_user_model().objects.create_user('loadtest-user-0', password='kept')
+
+    def _credentials(self, **options):
+        return loadtest.Command()._credentials({'users': 2, 'create_users': True, 'reuse_users': False, 'password': None, **options})
+
+    def test_refuses_to_take_over_existing_accounts(self):
+        with self.assertRaises(CommandError):
+            self._credentials()
+        with self.assertRaises(CommandError):
+            self._credentials(reuse_users=True)  # Without the accounts' password
+        self.existing.refresh_from_db()
+        self.assertTrue(self.existing.check_password('kept'))
+
+    def test_reuse_keeps_existing_passwords(self):
+        credentials, created = self._credentials(reuse_users=True, password='kept')
+        self.assertEqual(credentials, [('loadtest-user-0', 'kept'), ('loadtest-user-1', 'kept')])
+        self.assertEqual(created, ['loadtest-user-1'])
+        self.existing.refresh_from_db()
+        self.assertTrue(self.existing.check_password('kept'))
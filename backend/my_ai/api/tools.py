@@ -0,0 +1,292 @@
+import ast
+import json
+import logging
+import operator
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .caching import TTLCache
+from .models import ChatMessage, UploadedFile
+
+logger = logging.getLogger(__name__)
+
+# Defaults for function calling; override via settings.ASSISTANT_TOOLS
+ASSISTANT_TOOLS_DEFAULTS = {
+    'ENABLED': None,  # Names of registered tools exposed to assistants; None exposes all of them
+    'DEFAULT_TIMEOUT': 10,  # Seconds a tool may run before its call is answered with a timeout error
+    'MAX_STEPS': 8,  # requires_action rounds per run before the run is cancelled
+    'MAX_WORKERS': 8,  # Tool calls executed concurrently within one step
+    'CACHE_MAX_ENTRIES': 1024,
+}
+
+
+def get_tool_settings():
+    return {**ASSISTANT_TOOLS_DEFAULTS, **getattr(settings, 'ASSISTANT_TOOLS', {})}
+
+
+class ToolContext:
+    """What a tool handler may know about the call it is serving."""
+
+    def __init__(self, project, session=None, user=None):
+        self.project = project
+        self.session = session
+        self.user = user
+
+
+class Tool:
+    def __init__(self, name, description, parameters, handler, timeout=None, cache_ttl=None, per_project=False):
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+        self.handler = handler
+        self.timeout = timeout
+        # Deterministic tools set cache_ttl; per_project tools cache separately for each project
+        self.cache_ttl = cache_ttl
+        self.per_project = per_project
+
+    def definition(self):
+        return {
+            "type": "function",
+            "function": {"name": self.name, "description": self.description, "parameters": self.parameters},
+        }
+
+
+class ToolRegistry:
+    def __init__(self):
+        self._tools = {}
+        self.cache = TTLCache(max_entries=get_tool_settings()['CACHE_MAX_ENTRIES'])
+
+    def register(self, name, description, parameters, timeout=None, cache_ttl=None, per_project=False):
+        """Decorator registering `handler(arguments, context)` as a function tool."""
+        def decorator(handler):
+            self._tools[name] = Tool(name, description, parameters, handler, timeout, cache_ttl, per_project)
+            return handler
+        return decorator
+
+    def get(self, name):
+        return self._tools.get(name)
+
+    def enabled(self):
+        names = get_tool_settings()['ENABLED']
+        return [tool for name, tool in self._tools.items() if names is None or name in names]
+
+    def definitions(self):
+        return [tool.definition() for tool in self.enabled()]
+
+    def _cache_key(self, tool, arguments, context):
+        scope = context.project.id if tool.per_project else None
+        return (tool.name, scope, json.dumps(arguments, sort_keys=True))
+
+    def call(self, name, arguments, context):
+        """Run a tool (or serve it from cache) and return its output as a string."""
+        tool = self.get(name)
+        if tool is None or tool not in self.enabled():
+            return json.dumps({"error": f"Unknown tool: {name}"})
+
+        cache_key = self._cache_key(tool, arguments, context) if tool.cache_ttl else None
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        result = tool.handler(arguments, context)
+        output = result if isinstance(result, str) else json.dumps(result)
+        if cache_key is not None:
+            self.cache.set(cache_key, output, ttl=tool.cache_ttl)
+        return output
+
+
+registry = ToolRegistry()
+
+
+# --- Run loop --- #
+def _parse_arguments(raw):
+    try:
+        arguments = json.loads(raw or '{}')
+    except ValueError:
+        return None
+    return arguments if isinstance(arguments, dict) else None
+
+
+def _call_in_worker(name, arguments, context):
+    try:
+        return registry.call(name, arguments, context)
+    finally:
+        # Handlers may touch the ORM from this pool thread; don't leak its connection
+        connection.close()
+
+
+def execute_tool_calls(tool_calls, context):
+    """
+    Run every tool call of one step concurrently. Each call gets its tool's own
+    timeout measured from the start of the step, so the step takes as long as
+    its slowest tool rather than the sum of all of them.
+    Returns [(tool_call, arguments, output), ...] in the original order.
+    """
+    config = get_tool_settings()
+    started = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=max(1, min(len(tool_calls), config['MAX_WORKERS'])))
+    submitted = []
+    try:
+        for tool_call in tool_calls:
+            arguments = _parse_arguments(tool_call.function.arguments)
+            if arguments is None:
+                submitted.append((tool_call, {}, None, json.dumps({"error": "Arguments must be a JSON object."})))
+                continue
+            future = pool.submit(_call_in_worker, tool_call.function.name, arguments, context)
+            submitted.append((tool_call, arguments, future, None))
+
+        results = []
+        for tool_call, arguments, future, output in submitted:
+            if future is not None:
+                tool = registry.get(tool_call.function.name)
+                timeout = (tool.timeout if tool and tool.timeout else config['DEFAULT_TIMEOUT'])
+                try:
+                    output = future.result(timeout=max(0, started + timeout - time.monotonic()))
+                except FutureTimeoutError:
+                    logger.warning(f"Tool {tool_call.function.name} timed out after {timeout}s")
+                    output = json.dumps({"error": f"Tool timed out after {timeout} seconds."})
+                except Exception as e:
+                    logger.error(f"Tool {tool_call.function.name} failed: {e}", exc_info=True)
+                    output = json.dumps({"error": f"Tool failed: {e}"})
+            results.append((tool_call, arguments, output))
+        return results
+    finally:
+        # Timed-out tools cannot be interrupted; let them finish in the background
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _stored_output(output):
+    # Outputs are JSON strings; store the decoded value so the audit record is not double-encoded
+    try:
+        return json.loads(output)
+    except ValueError:
+        return output
+
+
+def resolve_required_actions(client, run, context):
+    """
+    Drive a run through its requires_action steps: execute the requested tools,
+    persist each call as a 'tool' message (when there is a session) and submit
+    all outputs of a step in a single submit_tool_outputs call. Returns the
+    final run.
+    """
+    max_steps = get_tool_settings()['MAX_STEPS']
+    steps = 0
+    while run.status == 'requires_action' and run.required_action.type == 'submit_tool_outputs':
+        if steps >= max_steps:
+            logger.error(f"Run {run.id} exceeded {max_steps} tool steps. Cancelling.")
+            return client.beta.threads.runs.cancel(thread_id=run.thread_id, run_id=run.id)
+        steps += 1
+
+        tool_calls = run.required_action.submit_tool_outputs.tool_calls
+        step_started = time.monotonic()
+        results = execute_tool_calls(tool_calls, context)
+        logger.info(f"Run {run.id} step {steps}: {len(results)} tool calls in {(time.monotonic() - step_started) * 1000:.0f} ms")
+
+        if context.session is not None:
+            ChatMessage.objects.bulk_create(
+                ChatMessage(
+                    session=context.session,
+                    role='tool',
+                    tool_call_id=tool_call.id,
+                    tool_name=tool_call.function.name,
+                    content=json.dumps({"arguments": arguments, "output": _stored_output(output)}),
+                )
+                for tool_call, arguments, output in results
+            )
+
+        run = client.beta.threads.runs.submit_tool_outputs_and_poll(
+            thread_id=run.thread_id,
+            run_id=run.id,
+            tool_outputs=[{"tool_call_id": tool_call.id, "output": output} for tool_call, _, output in results],
+        )
+    return run
+
+
+# --- Built-in tools --- #
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+_UNARY_OPERATORS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+# Integer results are capped by size: big-int arithmetic holds the GIL and cannot be interrupted by the
+# tool timeout, so an expression like ((9**99)**99)**99 would stall the whole worker process
+_MAX_INT_BITS = 10_000
+
+
+def _check_size(value):
+    if isinstance(value, int) and value.bit_length() > _MAX_INT_BITS:
+        raise ValueError("Result too large.")
+    return value
+
+
+def _evaluate(node):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return _check_size(node.value)
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        left, right = _evaluate(node.left), _evaluate(node.right)
+        if isinstance(node.op, ast.Pow) and isinstance(left, int) and isinstance(right, int) and right > 0:
+            # bits(a ** n) >= n * (bits(a) - 1), so this refuses powers that are sure to exceed the cap
+            if abs(left) > 1 and abs(left).bit_length() * right > _MAX_INT_BITS + right:
+                raise ValueError("Result too large.")
+        return _check_size(_BINARY_OPERATORS[type(node.op)](left, right))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+        return _UNARY_OPERATORS[type(node.op)](_evaluate(node.operand))
+    raise ValueError("Only numbers and + - * / // % ** are allowed.")
+
+
+@registry.register(
+    name="calculate",
+    description="Evaluate an arithmetic expression exactly. Supports + - * / // % ** and parentheses.",
+    parameters={
+        "type": "object",
+        "properties": {"expression": {"type": "string", "description": "e.g. (1200 * 0.15) + 30"}},
+        "required": ["expression"],
+    },
+    timeout=2,
+    cache_ttl=3600,
+)
+def calculate(arguments, context):
+    expression = str(arguments.get("expression", ""))
+    if len(expression) > 200:
+        return {"error": "Expression too long."}
+    try:
+        return {"result": _evaluate(ast.parse(expression, mode='eval'))}
+    except (SyntaxError, ValueError, ZeroDivisionError, OverflowError) as e:
+        return {"error": str(e)}
+
+
+@registry.register(
+    name="get_current_datetime",
+    description="Get the current date and time (UTC, ISO 8601).",
+    parameters={"type": "object", "properties": {}},
+    timeout=1,
+)
+def get_current_datetime(arguments, context):
+    return {"now": timezone.now().isoformat()}
+
+
+@registry.register(
+    name="list_project_files",
+    description="List the names of the files uploaded to this project's knowledge base.",
+    parameters={"type": "object", "properties": {}},
+    timeout=5,
+    cache_ttl=60,
+    per_project=True,
+)
+def list_project_files(arguments, context):
+    filenames = UploadedFile.objects.filter(project=context.project).order_by('filename').values_list('filename', flat=True)
+    return {"files": list(filenames)}
@@ -8,6 +8,13 @@ from .views import (
     ChatSessionDetailView,
     ChatMessageView,
     ChatMessageListView,
+    UsageView,
+    BatchJobListCreateView,
+    BatchJobDetailView,
+    BatchJobResultsView,
+    ProfileListView,
+    ProfileDetailView,
+    ProfileHotFramesView,
     login_view,
     logout_view
 )
@@ -34,4 +41,18 @@ urlpatterns = [
 
     # --- URL for Listing Messages --- #
     path('projects/<int:project_id>/sessions/<int:session_id>/messages/', ChatMessageListView.as_view(), name='chatmessage-list'),
+
+    # Batch question answering URLs (scoped to a project)
+    path('projects/<int:project_id>/batches/', BatchJobListCreateView.as_view(), name='batchjob-list-create'),
+    path('projects/<int:project_id>/batches/<int:job_id>/', BatchJobDetailView.as_view(), name='batchjob-detail'),
+    path('projects/<int:project_id>/batches/<int:job_id>/results/', BatchJobResultsView.as_view(), name='batchjob-results'),
+
+    # Request profiling URLs (staff only)
+    path('profiles/', ProfileListView.as_view(), name='profile-list'),
+    path('profiles/hot-frames/', ProfileHotFramesView.as_view(), name='profile-hot-frames'),
+    path('profiles/<str:profile_id>/', ProfileDetailView.as_view(), name='profile-detail'),
+
+    # Usage accounting URLs
+    path('usage/', UsageView.as_view(), name='usage'),
+    path('projects/<int:project_id>/usage/', UsageView.as_view(), name='project-usage'),
 ]
@@ -0,0 +1,104 @@
+import logging
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import DailyUsage, UsageRecord
+
+logger = logging.getLogger(__name__)
+
+# Model used for runs once a project with budget_exceeded_action='downgrade' exhausts its budget
+BUDGET_DOWNGRADE_MODEL = getattr(settings, 'USAGE_BUDGET_DOWNGRADE_MODEL', 'gpt-3.5-turbo')
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def _bump_daily_usage(project, user, date, prompt_tokens, completion_tokens, duration_ms):
+    increments = {
+        'run_count': F('run_count') + 1,
+        'prompt_tokens': F('prompt_tokens') + prompt_tokens,
+        'completion_tokens': F('completion_tokens') + completion_tokens,
+        'total_duration_ms': F('total_duration_ms') + duration_ms,
+    }
+    rollup = DailyUsage.objects.filter(project=project, user=user, date=date)
+    if rollup.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            DailyUsage.objects.create(
+                project=project,
+                user=user,
+                date=date,
+                run_count=1,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_duration_ms=duration_ms,
+            )
+    except IntegrityError:
+        # Another worker created today's row between our update and insert
+        rollup.update(**increments)
+
+
+def record_run_usage(project, run, duration_ms, model, user=None, session=None, message=None):
+    """
+    Write a ledger row for a finished run and fold it into the daily rollup.
+    Runs without usage information (e.g. cancelled before starting) are skipped.
+    """
+    usage = getattr(run, 'usage', None)
+    if usage is None:
+        return None
+
+    if user is not None and not user.is_authenticated:
+        user = None
+    prompt_tokens = usage.prompt_tokens or 0
+    completion_tokens = usage.completion_tokens or 0
+
+    try:
+        with transaction.atomic():
+            record = UsageRecord.objects.create(
+                project=project,
+                session=session,
+                message=message,
+                user=user,
+                model=model,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                duration_ms=duration_ms,
+            )
+            _bump_daily_usage(project, user, timezone.localdate(), prompt_tokens, completion_tokens, duration_ms)
+    except Exception as e:
+        # Usage accounting must never fail the reply it is accounting for
+        logger.error(f"Failed to record usage for run {run.id}: {e}", exc_info=True)
+        return None
+    logger.info(f"Recorded usage for run {run.id}: {prompt_tokens}+{completion_tokens} tokens on {model} in {duration_ms} ms")
+    return record
+
+
+def get_monthly_tokens(project):
+    """Tokens used by `project` in the current calendar month, read from the daily rollups."""
+    month_start = timezone.localdate().replace(day=1)
+    totals = DailyUsage.objects.filter(project=project, date__gte=month_start).aggregate(
+        prompt=Sum('prompt_tokens'),
+        completion=Sum('completion_tokens'),
+    )
+    return (totals['prompt'] or 0) + (totals['completion'] or 0)
+
+
+def resolve_run_model(project):
+    """
+    Return the model to run the next message with, honouring the project's budget.
+    Raises BudgetExceeded when the budget is exhausted and the project rejects requests.
+    """
+    if project.monthly_token_budget is None:
+        return project.model
+    used = get_monthly_tokens(project)
+    if used < project.monthly_token_budget:
+        return project.model
+    if project.budget_exceeded_action == 'downgrade':
+        logger.warning(f"Project {project.id} exhausted its token budget ({used}/{project.monthly_token_budget}). Downgrading to {BUDGET_DOWNGRADE_MODEL}.")
+        return BUDGET_DOWNGRADE_MODEL
+    raise BudgetExceeded(f"Monthly token budget exhausted ({used}/{project.monthly_token_budget} tokens).")
@@ -1,4 +1,5 @@
 from django.shortcuts import render, get_object_or_404
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage
 from django.contrib.auth import authenticate
@@ -6,14 +7,31 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics, serializers
 from rest_framework.authtoken.models import Token
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.decorators import api_view, permission_classes
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from openai import OpenAI
+import datetime
+import json
 import os
 import logging
-
-from .models import Project, UploadedFile, ChatSession, ChatMessage
-from .serializers import ProjectSerializer, UploadedFileSerializer, ChatSessionSerializer, ChatMessageSerializer
+import time
+
+from .models import Project, UploadedFile, ChatSession, ChatMessage, ArchivedSession, DailyUsage, BatchJob, BatchQuestion
+from .serializers import ProjectSerializer, UploadedFileSerializer, ChatSessionSerializer, ChatMessageSerializer, DailyUsageSerializer, BatchJobSerializer
+from .authentication import invalidate_token
+from .archive import read_archived_messages, rehydrate_session
+from .citations import CitationRenderer, save_citations
+from .fast_serializers import FastListMixin
+from .usage import BudgetExceeded, get_monthly_tokens, record_run_usage, resolve_run_model
+from .routing import choose_model, record_run_outcome
+from .batch import BatchJobBusy, BatchRunner, stored_results
+from .profiling import get_profile_store, hot_frames, summarize, to_collapsed
+from .tools import ToolContext, registry as tool_registry, resolve_required_actions
+from .scheduler import AdmissionControlMixin, AdmissionRejected, estimate_run_tokens, rejected_response, run_scheduler
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -21,6 +39,27 @@ logger = logging.getLogger(__name__)
 # Initialize OpenAI client
 client = OpenAI(api_key=settings.OPENAI_API_KEY)
 
+# --- Helper Functions for Assistant tools --- #
+def assistant_tools(project):
+    """Tool definitions an assistant for `project` should have."""
+    tools = [{"type": "file_search"}] if project.openai_vector_store_id else []
+    return tools + tool_registry.definitions()
+
+def _tool_signature(tools):
+    # Comparable summary of tool definitions, whether they are API objects or plain dicts
+    signature = set()
+    for tool in tools:
+        if not isinstance(tool, dict):
+            tool = tool.model_dump(exclude_none=True)
+        function = tool.get('function') or {}
+        signature.add((
+            tool.get('type'),
+            function.get('name'),
+            function.get('description'),
+            json.dumps(function.get('parameters'), sort_keys=True),
+        ))
+    return signature
+
 # --- Helper Function to get or create Assistant --- #
 def get_or_create_assistant(project):
     if project.openai_assistant_id:
@@ -36,36 +75,27 @@ def get_or_create_assistant(project):
                 )
                 logger.info(f"Updated Assistant {assistant.id} model to {project.model}.")
 
-            # Ensure the assistant is linked to the vector store if available
+            # Ensure the assistant's tools (file_search + registered functions) and vector store linkage match the project
+            desired_tools = assistant_tools(project)
             if project.openai_vector_store_id:
-                should_update = False
-                
-                # Check if tools need to be added
-                if not hasattr(assistant, 'tools') or not any(tool.get('type') == 'file_search' for tool in assistant.tools):
-                    logger.warning(f"Assistant {assistant.id} missing file_search tool. Will update.")
-                    should_update = True
-                
-                # Check if vector store linkage needs to be updated
-                if not hasattr(assistant, 'tool_resources') or not hasattr(assistant.tool_resources, 'file_search') or project.openai_vector_store_id not in assistant.tool_resources.file_search.vector_store_ids:
+                file_search = getattr(getattr(assistant, 'tool_resources', None), 'file_search', None)
+                linked_ids = getattr(file_search, 'vector_store_ids', None) or []
+                if project.openai_vector_store_id not in linked_ids:
                     logger.warning(f"Assistant {assistant.id} not linked to vector store {project.openai_vector_store_id}. Will update.")
-                    should_update = True
-                
-                if should_update:
                     assistant = client.beta.assistants.update(
                         assistant_id=assistant.id,
-                        tools=[{"type": "file_search"}],
+                        tools=desired_tools,
                         tool_resources={"file_search": {"vector_store_ids": [project.openai_vector_store_id]}}
                     )
                     logger.info(f"Updated Assistant {assistant.id} with vector store linkage.")
-            elif hasattr(assistant, 'tool_resources') and hasattr(assistant.tool_resources, 'file_search'):
-                # Remove vector store linkage if project no longer has a vector store
-                logger.warning(f"Assistant {assistant.id} has file_search tool but project has no vector store. Removing tool.")
-                assistant = client.beta.assistants.update(
-                    assistant_id=assistant.id,
-                    tools=[],  # Remove file_search tool
-                    tool_resources={}
-                )
-                logger.info(f"Removed file_search tool from Assistant {assistant.id}.")
+            if _tool_signature(getattr(assistant, 'tools', None) or []) != _tool_signature(desired_tools):
+                logger.warning(f"Assistant {assistant.id} tools differ from project configuration. Updating.")
+                update_params = {"assistant_id": assistant.id, "tools": desired_tools}
+                if not project.openai_vector_store_id:
+                    # Remove vector store linkage if project no longer has a vector store
+                    update_params["tool_resources"] = {}
+                assistant = client.beta.assistants.update(**update_params)
+                logger.info(f"Updated tools of Assistant {assistant.id}.")
             return assistant
         except Exception as e:
             logger.error(f"Failed to retrieve or update assistant {project.openai_assistant_id}, creating new one: {e}")
@@ -79,9 +109,9 @@ def get_or_create_assistant(project):
             "model": project.model, # Use the model from the project
         }
         
+        assistant_params["tools"] = assistant_tools(project)
         # Add file_search tool and vector_store only if available
         if project.openai_vector_store_id:
-            assistant_params["tools"] = [{"type": "file_search"}]
             assistant_params["tool_resources"] = {"file_search": {"vector_store_ids": [project.openai_vector_store_id]}}
             logger.info(f"Creating assistant with vector store {project.openai_vector_store_id}")
         else:
@@ -96,6 +126,15 @@ def get_or_create_assistant(project):
         logger.error(f"Error creating Assistant for Project {project.id}: {e}")
         raise
 
+# --- Helper Function to build a reply from assistant messages --- #
+def build_assistant_reply(messages, retrieve_file=None):
+    """
+    Join the text of every assistant message in `messages`, replacing annotations
+    with numbered markers. Returns (reply_text, citations).
+    `retrieve_file` defaults to the OpenAI files API and may be swapped for a cached lookup.
+    """
+    return CitationRenderer(retrieve_file or client.files.retrieve).render(messages)
+
 # --- Project Views --- #
 class ProjectListCreateView(generics.ListCreateAPIView):
     queryset = Project.objects.all()
@@ -107,7 +146,7 @@ class ProjectDetailView(generics.RetrieveUpdateDestroyAPIView):
     lookup_url_kwarg = 'project_id'
 
 # --- File Upload View --- #
-class FileUploadView(APIView):
+class FileUploadView(AdmissionControlMixin, APIView):
     def post(self, request, project_id, *args, **kwargs):
         project = get_object_or_404(Project, pk=project_id)
         file_obj = request.FILES.get('file')
@@ -115,6 +154,12 @@ class FileUploadView(APIView):
         if not file_obj:
             return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
 
+        # --- Admission control --- #
+        try:
+            self.scheduler_ticket = run_scheduler.acquire(request.user.pk, project.id, 'files')
+        except AdmissionRejected as e:
+            return rejected_response(e)
+
         openai_file = None
         vector_store_id = project.openai_vector_store_id
         fs = FileSystemStorage(location=os.path.join(settings.BASE_DIR, 'tmp'))
@@ -186,9 +231,11 @@ class FileUploadView(APIView):
                 logger.info(f"Cleaned up temporary file {filename}")
 
             return Response({"error": f"An unexpected error occurred: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        finally:
+            run_scheduler.release(self.scheduler_ticket)
 
 # --- File List View --- #
-class FileListView(generics.ListAPIView):
+class FileListView(FastListMixin, generics.ListAPIView):
     serializer_class = UploadedFileSerializer
 
     def get_queryset(self):
@@ -201,7 +248,8 @@ class ChatSessionListCreateView(generics.ListCreateAPIView):
 
     def get_queryset(self):
         project_id = self.kwargs['project_id']
-        return ChatSession.objects.filter(project_id=project_id)
+        # Most recently active sessions first, with counts and previews in the same query
+        return ChatSession.objects.filter(project_id=project_id).with_activity().order_by('-last_activity_at', '-id')
 
     def perform_create(self, serializer):
         project = get_object_or_404(Project, pk=self.kwargs['project_id'])
@@ -219,7 +267,7 @@ class ChatSessionDetailView(generics.RetrieveUpdateDestroyAPIView):
 
     def get_queryset(self):
         project_id = self.kwargs['project_id']
-        return ChatSession.objects.filter(project_id=project_id)
+        return ChatSession.objects.filter(project_id=project_id).with_activity()
 
     def perform_destroy(self, instance):
         try:
@@ -231,7 +279,7 @@ class ChatSessionDetailView(generics.RetrieveUpdateDestroyAPIView):
         instance.delete()
 
 # --- Chat Interaction View --- #
-class ChatMessageView(APIView):
+class ChatMessageView(AdmissionControlMixin, APIView):
     def post(self, request, project_id, session_id, *args, **kwargs):
         project = get_object_or_404(Project, pk=project_id)
         chat_session = get_object_or_404(ChatSession, pk=session_id, project=project)
@@ -246,13 +294,38 @@ class ChatMessageView(APIView):
 
         thread_id = chat_session.openai_thread_id
 
+        # --- Enforce the project's token budget --- #
+        try:
+            run_model = resolve_run_model(project)
+        except BudgetExceeded as e:
+            logger.warning(f"Rejected message for project {project.id}: {e}")
+            return Response({"error": str(e)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+        # --- Pick a model for this message (adaptive routing projects only) --- #
+        # A budget downgrade always wins over routing
+        if run_model == project.model:
+            run_model, routing_reason = choose_model(project, user_message_content)
+            logger.info(f"Routing message for project {project.id} to {run_model} ({routing_reason})")
+
+        # --- Admission control: wait for a fair share of OpenAI capacity --- #
+        try:
+            ticket = run_scheduler.acquire(request.user.pk, project.id, run_model, estimate_run_tokens(user_message_content))
+        except AdmissionRejected as e:
+            return rejected_response(e)
+        self.scheduler_ticket = ticket
+
         try:
             # --- Save User Message to DB --- #
-            ChatMessage.objects.create(
-                session=chat_session,
-                role='user',
-                content=user_message_content
-            )
+            with transaction.atomic():
+                # Write first so the transaction takes the write lock up front (SQLite raises
+                # "database is locked" when a transaction that started with a read upgrades)
+                ChatMessage.objects.create(
+                    session=chat_session,
+                    role='user',
+                    content=user_message_content
+                )
+                # Continuing an archived conversation brings its history back into the hot table
+                rehydrate_session(chat_session)
             logger.info(f"Saved user message for session {session_id}")
 
             assistant = get_or_create_assistant(project)
@@ -265,11 +338,23 @@ class ChatMessageView(APIView):
                 content=user_message_content,
             )
 
-            # Run the assistant
-            run = client.beta.threads.runs.create_and_poll(
-                thread_id=thread_id,
-                assistant_id=assistant_id,
-            )
+            # Run the assistant, overriding the model per run when routing or the budget picks
+            # a different one so the assistant itself is never reconfigured
+            run_params = {"thread_id": thread_id, "assistant_id": assistant_id}
+            if run_model != project.model:
+                run_params["model"] = run_model
+            run_started = time.monotonic()
+            try:
+                run = client.beta.threads.runs.create_and_poll(**run_params)
+                # Function calls are executed here, so the run's duration includes its tool steps
+                run = resolve_required_actions(client, run, ToolContext(project, chat_session, request.user))
+            except Exception:
+                # Timeouts, 5xx and rate limits surface as exceptions; routing must count them as failures
+                record_run_outcome(run_model, int((time.monotonic() - run_started) * 1000), ok=False)
+                raise
+            run_duration_ms = int((time.monotonic() - run_started) * 1000)
+            record_run_outcome(run_model, run_duration_ms, ok=run.status == 'completed')
+            usage_kwargs = {"user": request.user, "session": chat_session}
 
             if run.status == 'completed':
                 messages = client.beta.threads.messages.list(
@@ -277,74 +362,47 @@ class ChatMessageView(APIView):
                     order="asc",
                     after=message.id # Fetch messages created after the user's message
                 )
-                assistant_responses_content = []
-                citations = []
-                full_assistant_response_text = ""
-
-                for msg in messages.data:
-                    if msg.role == "assistant":
-                        current_message_text = ""
-                        for content_block in msg.content:
-                             if content_block.type == 'text':
-                                 text_value = content_block.text.value
-                                 current_message_text += text_value # Accumulate text from blocks
-                                 # Process citations within this text block
-                                 if hasattr(content_block.text, 'annotations') and content_block.text.annotations:
-                                     processed_text_value = text_value
-                                     for index, annotation in enumerate(content_block.text.annotations):
-                                         # Use a unique marker based on citation list length
-                                         marker = f" [{len(citations) + 1}]"
-                                         processed_text_value = processed_text_value.replace(annotation.text, marker)
-                                         if hasattr(annotation, 'file_citation'):
-                                             try:
-                                                 cited_file = client.files.retrieve(annotation.file_citation.file_id)
-                                                 citations.append({
-                                                     "marker": marker.strip(), # Store without spaces
-                                                     "file_id": cited_file.id,
-                                                     "filename": cited_file.filename,
-                                                     "quote": annotation.text
-                                                 })
-                                                 logger.info(f"Citation{marker}: File '{cited_file.filename}' (ID: {cited_file.id})")
-                                             except Exception as cite_err:
-                                                 logger.error(f"Error retrieving cited file {annotation.file_citation.file_id}: {cite_err}")
-                                         elif hasattr(annotation, 'file_path'):
-                                              try:
-                                                  cited_file = client.files.retrieve(annotation.file_path.file_id)
-                                                  citations.append({
-                                                     "marker": marker.strip(), # Store without spaces
-                                                     "file_id": cited_file.id,
-                                                     "filename": cited_file.filename,
-                                                     "type": "file_path"
-                                                 })
-                                                  logger.info(f"Citation{marker}: File Path in '{cited_file.filename}' (ID: {cited_file.id})")
-                                              except Exception as cite_err:
-                                                  logger.error(f"Error retrieving cited file path {annotation.file_path.file_id}: {cite_err}")
-                                     # Update the accumulated text with processed citations for this block
-                                     current_message_text = current_message_text.replace(text_value, processed_text_value)
-
-                        if current_message_text:
-                            assistant_responses_content.append(current_message_text)
-
-                full_assistant_response_text = "\n".join(assistant_responses_content)
+                full_assistant_response_text, citations = build_assistant_reply(messages.data)
 
+                assistant_message = None
                 if not full_assistant_response_text:
                      logger.warning(f"Run {run.id} completed but no assistant message content found.")
                      # Still save an empty assistant message? Or handle differently?
                      # For now, let's not save an empty message.
-                     return Response({"reply": "Assistant processed the request but did not generate a text response.", "citations": []})
                 else:
                     # --- Save Assistant Message to DB --- #
-                    ChatMessage.objects.create(
+                    assistant_message = ChatMessage.objects.create(
                         session=chat_session,
                         role='assistant',
                         content=full_assistant_response_text # Save the combined/processed text
                     )
-                    logger.info(f"Saved assistant message for session {session_id}")
-
-                return Response({"reply": full_assistant_response_text, "citations": citations})
-
-            elif run.status == 'requires_action':
-                 logger.warning(f"Run {run.id} requires action (e.g., function call), which is not implemented.")
+                    save_citations(assistant_message, citations)
+                    logger.info(f"Saved assistant message for session {session_id} with {len(citations)} citations")
+
+                # --- Record token usage and latency --- #
+                usage_record = record_run_usage(project, run, run_duration_ms, run_model, message=assistant_message, **usage_kwargs)
+                if usage_record:
+                    ticket.used_tokens = usage_record.prompt_tokens + usage_record.completion_tokens
+                usage = {
+                    "model": run_model,
+                    "prompt_tokens": usage_record.prompt_tokens if usage_record else None,
+                    "completion_tokens": usage_record.completion_tokens if usage_record else None,
+                    "duration_ms": run_duration_ms,
+                    "queue_wait_ms": ticket.wait_ms,
+                }
+
+                if assistant_message is None:
+                    return Response({"reply": "Assistant processed the request but did not generate a text response.", "citations": [], "usage": usage})
+                return Response({"reply": full_assistant_response_text, "citations": citations, "usage": usage})
+
+            # Failed or incomplete runs may still have consumed tokens
+            usage_record = record_run_usage(project, run, run_duration_ms, run_model, **usage_kwargs)
+            if usage_record:
+                ticket.used_tokens = usage_record.prompt_tokens + usage_record.completion_tokens
+
+            if run.status == 'requires_action':
+                 # Only reached for action types other than submit_tool_outputs
+                 logger.warning(f"Run {run.id} requires unsupported action {run.required_action.type}.")
                  return Response({"error": "Assistant run requires further action."}, status=status.HTTP_501_NOT_IMPLEMENTED)
             else:
                 logger.error(f"Assistant run failed or stopped. Status: {run.status}, Error: {run.last_error}")
@@ -356,9 +414,11 @@ class ChatMessageView(APIView):
         except Exception as e:
             logger.error(f"Error during chat processing for session {session_id}: {e}", exc_info=True)
             return Response({"error": f"An unexpected error occurred: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        finally:
+            run_scheduler.release(ticket)
 
 # --- New View to List Messages for a Session --- #
-class ChatMessageListView(generics.ListAPIView):
+class ChatMessageListView(FastListMixin, generics.ListAPIView):
     serializer_class = ChatMessageSerializer
 
     def get_queryset(self):
@@ -366,7 +426,151 @@ class ChatMessageListView(generics.ListAPIView):
         session_id = self.kwargs['session_id']
         # Ensure the session belongs to the project before querying messages
         get_object_or_404(ChatSession, pk=session_id, project_id=project_id)
-        return ChatMessage.objects.filter(session_id=session_id).order_by('timestamp')
+        return ChatMessage.objects.filter(session_id=session_id).prefetch_related('citations').order_by('timestamp')
+
+    def list(self, request, *args, **kwargs):
+        archive = ArchivedSession.objects.filter(
+            session_id=self.kwargs['session_id'], session__project_id=self.kwargs['project_id']
+        ).first()
+        if archive is None:
+            return super().list(request, *args, **kwargs)
+        # The archive block already holds the rendered JSON list; serve it without touching the hot table
+        rendered = read_archived_messages(archive)
+        if self.paginator is None and request.accepted_renderer.format == 'json':
+            return HttpResponse(rendered, content_type='application/json')
+        items = json.loads(rendered)
+        page = self.paginate_queryset(items)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(items)
+
+# --- Usage View --- #
+class UsageView(APIView):
+    """
+    Token usage and run latency from the daily rollups, optionally scoped to a project.
+    Accepts `start` and `end` (YYYY-MM-DD) query parameters; defaults to the last 30 days.
+    """
+    def get(self, request, project_id=None, *args, **kwargs):
+        end = parse_date(request.query_params.get('end', '')) or timezone.localdate()
+        start = parse_date(request.query_params.get('start', '')) or end - datetime.timedelta(days=29)
+        if start > end:
+            return Response({"error": "start must not be after end."}, status=status.HTTP_400_BAD_REQUEST)
+
+        rollups = DailyUsage.objects.filter(date__gte=start, date__lte=end)
+        project = None
+        if project_id is not None:
+            project = get_object_or_404(Project, pk=project_id)
+            rollups = rollups.filter(project=project)
+
+        totals = rollups.aggregate(
+            run_count=Sum('run_count'),
+            prompt_tokens=Sum('prompt_tokens'),
+            completion_tokens=Sum('completion_tokens'),
+            total_duration_ms=Sum('total_duration_ms'),
+        )
+        data = {
+            "start": start,
+            "end": end,
+            "totals": {key: value or 0 for key, value in totals.items()},
+            "daily": DailyUsageSerializer(rollups.order_by('-date', 'project_id', 'user_id'), many=True).data,
+        }
+        if project is not None:
+            data["budget"] = {
+                "monthly_token_budget": project.monthly_token_budget,
+                "budget_exceeded_action": project.budget_exceeded_action,
+                "tokens_used_this_month": get_monthly_tokens(project),
+            }
+        return Response(data)
+
+# --- Batch Question Answering Views --- #
+class BatchJobListCreateView(generics.ListCreateAPIView):
+    serializer_class = BatchJobSerializer
+
+    def get_queryset(self):
+        return BatchJob.objects.filter(project_id=self.kwargs['project_id'])
+
+    def perform_create(self, serializer):
+        project = get_object_or_404(Project, pk=self.kwargs['project_id'])
+        questions = serializer.validated_data.pop('questions')
+        job = serializer.save(project=project, user=self.request.user)
+        BatchQuestion.objects.bulk_create(
+            BatchQuestion(job=job, index=index, question=question) for index, question in enumerate(questions)
+        )
+        logger.info(f"Created batch job {job.id} with {len(questions)} questions for project {project.id}")
+
+class BatchJobDetailView(generics.RetrieveDestroyAPIView):
+    serializer_class = BatchJobSerializer
+    lookup_url_kwarg = 'job_id'
+
+    def get_queryset(self):
+        return BatchJob.objects.filter(project_id=self.kwargs['project_id'])
+
+class BatchJobResultsView(APIView):
+    """
+    GET returns the results stored so far as NDJSON without running anything.
+    POST runs (or resumes) the job and streams its results as NDJSON, one line
+    per question as it finishes, followed by a summary line with throughput.
+    Starting billed runs is kept off GET so prefetchers and retries cannot trigger it.
+    """
+    def get(self, request, project_id, job_id, *args, **kwargs):
+        job = get_object_or_404(BatchJob, pk=job_id, project_id=project_id)
+        return StreamingHttpResponse(
+            (json.dumps(result) + "\n" for result in stored_results(job)),
+            content_type='application/x-ndjson'
+        )
+
+    def post(self, request, project_id, job_id, *args, **kwargs):
+        job = get_object_or_404(BatchJob.objects.select_related('project', 'user'), pk=job_id, project_id=project_id)
+        runner = BatchRunner(job, client, get_or_create_assistant, build_assistant_reply)
+        try:
+            runner.start()
+        except BudgetExceeded as e:
+            return Response({"error": str(e)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        except BatchJobBusy as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+
+        return StreamingHttpResponse(
+            (json.dumps(result) + "\n" for result in runner.results()),
+            content_type='application/x-ndjson'
+        )
+
+# --- Request Profile Views (staff only) --- #
+class ProfileListView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        view_name = request.query_params.get('view')
+        profiles = (summarize(p) for p in get_profile_store().iter_profiles())
+        return Response([p for p in profiles if not view_name or p['view'] == view_name])
+
+class ProfileDetailView(APIView):
+    """Download one profile as JSON, or with ?output=collapsed as collapsed stacks for flame graph tools."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, profile_id, *args, **kwargs):
+        profile = get_profile_store().load(profile_id)
+        if profile is None:
+            raise Http404("Profile not found.")
+        if request.query_params.get('output') == 'collapsed':
+            response = HttpResponse(to_collapsed(profile), content_type='text/plain; charset=utf-8')
+            response['Content-Disposition'] = f'attachment; filename="{profile_id}.collapsed.txt"'
+        else:
+            response = Response(profile)
+            response['Content-Disposition'] = f'attachment; filename="{profile_id}.json"'
+        return response
+
+class ProfileHotFramesView(APIView):
+    """Hottest frames per view across stored profiles (optionally ?view=<view name>&limit=N)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        view_name = request.query_params.get('view')
+        try:
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response({"error": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        profiles = (p for p in get_profile_store().iter_profiles() if not view_name or p['view'] == view_name)
+        return Response(hot_frames(profiles, limit=limit))
 
 # --- Authentication Views --- #
 @api_view(['POST'])
@@ -393,7 +597,9 @@ def login_view(request):
 @permission_classes([IsAuthenticated])
 def logout_view(request):
     try:
+        token_key = request.user.auth_token.key
         request.user.auth_token.delete()
+        invalidate_token(token_key)
         logger.info(f"User {request.user.username} logged out successfully.")
         return Response({"message": "Logged out successfully."}, status=status.HTTP_200_OK)
     except Exception as e:
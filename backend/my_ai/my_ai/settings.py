@@ -52,6 +52,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'api.profiling.SampledProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -146,7 +147,7 @@ CORS_ALLOW_ALL_ORIGINS = True
 # Django REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -154,6 +155,54 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Token authentication cache (see api/authentication.py)
+TOKEN_AUTH_CACHE = {
+    'MAX_ENTRIES': 1024,
+    'TTL': 300,
+    # Set to a Django cache alias (e.g. a shared Redis cache) to share the token cache across processes.
+    # Without it each worker caches tokens on its own, so logout and user changes take effect immediately
+    # only with a single worker process; other workers keep a revoked token for up to TTL seconds.
+    'BACKEND': os.environ.get('TOKEN_AUTH_CACHE_BACKEND') or None,
+}
+
+# Model used once a project with budget_exceeded_action='downgrade' exhausts its monthly token budget
+USAGE_BUDGET_DOWNGRADE_MODEL = 'gpt-3.5-turbo'
+
+# Admission control in front of OpenAI calls (see api/scheduler.py for all options).
+# Rate limits are the org-wide RPM/TPM per model and are split across WORKER_PROCESSES.
+RUN_SCHEDULER = {
+    'MAX_CONCURRENT': 8,
+    'MAX_QUEUE_DEPTH': 64,
+    'QUEUE_TIMEOUT': 30,
+    'WORKER_PROCESSES': int(os.environ.get('WEB_CONCURRENCY', 1)),
+    'RATE_LIMITS': {
+        'default': {'rpm': 500, 'tpm': 30000},
+        'files': {'rpm': 100, 'tpm': None},
+    },
+}
+
+# Sampled request profiling (see api/profiling.py); profiles are listed at /api/profiles/ for staff
+REQUEST_PROFILING = {
+    'ENABLED': os.environ.get('REQUEST_PROFILING_ENABLED') == '1',
+    'SAMPLE_RATE': 0.01,
+    'LATENCY_THRESHOLD_MS': None,
+    'DIRECTORY': os.path.join(BASE_DIR, 'profiles'),
+    'MAX_PROFILES': 200,
+}
+
+# Function tools exposed to assistants (see api/tools.py); ENABLED=None exposes every registered tool
+ASSISTANT_TOOLS = {
+    'ENABLED': None,
+    'DEFAULT_TIMEOUT': 10,
+    'MAX_STEPS': 8,
+}
+
+# Archival of idle chat sessions (see api/archive.py); run `manage.py archive_sessions` periodically
+CHAT_ARCHIVE = {
+    'IDLE_DAYS': 90,
+    'CODEC': 'zstd',  # Falls back to zlib when the zstandard package is not installed
+}
+
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static'),
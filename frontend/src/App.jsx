@@ -116,7 +116,8 @@ function App() {
   };
 
   const handleSessionCreated = (newSession) => {
-    setSessions(prevSessions => [...prevSessions, newSession]);
+    // Sessions are listed by most recent activity, so a new one goes on top
+    setSessions(prevSessions => [newSession, ...prevSessions]);
     setSelectedSession(newSession);
     setIsLoading(false);
   };
@@ -79,7 +79,8 @@ function ChatWindow({ selectedProject, selectedSession, isLoading, setIsLoading,
         onError('');
         try {
           const response = await apiService.fetchMessages(selectedProject.id, selectedSession.id);
-          setMessages(response.data);
+          // Tool call records are kept for auditing but not shown in the conversation
+          setMessages(response.data.filter(msg => msg.role !== 'tool'));
         } catch (err) {
           console.error("Error fetching messages:", err);
           onError('Failed to load message history.');
@@ -126,7 +127,7 @@ function ChatWindow({ selectedProject, selectedSession, isLoading, setIsLoading,
 
       // Fetch the latest messages again after sending
       const updatedMessagesResponse = await apiService.fetchMessages(selectedProject.id, selectedSession.id);
-      setMessages(updatedMessagesResponse.data);
+      setMessages(updatedMessagesResponse.data.filter(msg => msg.role !== 'tool'));
     } catch (err) {
       console.error("Error sending message:", err);
       onError('Failed to send message or get reply.');
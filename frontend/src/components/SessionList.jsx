@@ -88,7 +88,8 @@ function SessionList({ sessions, selectedSession, onSelectSession, onSessionCrea
 
       <ul className="list">
         {sessions.length > 0 ? sessions.map(session => {
-          // Check if session has a created_at property, assuming it comes from the API
+          // Prefer the last message time; fall back to creation time for empty sessions
+          const lastMessageAt = session.last_message_at;
           const timestamp = session.created_at || session.timestamp;
           
           return (
@@ -100,7 +101,16 @@ function SessionList({ sessions, selectedSession, onSelectSession, onSessionCrea
               <span className="item-icon">💬</span>
               <div style={{ flex: 1, minWidth: 0 }}>
                 <span className="item-content">{session.name || `Session ${session.id}`}</span>
-                {timestamp && (
+                {session.last_message_preview && (
+                  <div className="item-metadata item-preview">
+                    {session.last_message_preview}
+                  </div>
+                )}
+                {lastMessageAt ? (
+                  <div className="item-metadata">
+                    Last message: {formatTimestamp(lastMessageAt)}
+                  </div>
+                ) : timestamp && (
                   <div className="item-metadata">
                     Created: {formatTimestamp(timestamp)}
                   </div>